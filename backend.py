@@ -0,0 +1,81 @@
+import numpy as np
+import networkx as nx
+
+BACKENDS = ('cplex', 'native')
+
+
+class SolverBackend:
+    # node relaxation interface driven by BranchAndBound: vars are fixed through their bounds,
+    # solve_problem returns an upper bound of the node and get_solution the point attaining it
+    name = None
+    # errors of a single solve, BranchAndBound leaves the node unsolved on them
+    SolverError = RuntimeError
+    # rows can be added and removed: constraint branching and cuts
+    supports_rows = False
+
+    def __init__(self, graph: nx.Graph):
+        self.graph = graph
+        self.build_time = None
+        self.build_peak_memory = None
+
+    def design_problem(self, trace_memory: bool = False):
+        raise NotImplementedError
+
+    def solve_problem(self, lower_bound: float = None) -> float:
+        # nodes with no solution better than lower_bound may return any value <= lower_bound
+        raise NotImplementedError
+
+    def get_solution(self) -> list:
+        raise NotImplementedError
+
+    def get_solution_array(self) -> np.ndarray:
+        return np.asarray(self.get_solution(), dtype=float)
+
+    def fix_variables(self, var_indexes: list, value: float):
+        raise NotImplementedError
+
+    def restore_bounds(self, var_indexes: list):
+        raise NotImplementedError
+
+    def get_basis(self):
+        return None
+
+    def set_basis(self, basis):
+        return
+
+    def get_num_iterations(self) -> int:
+        return 0
+
+    def set_time_limit(self, seconds: float):
+        # a solve running longer than seconds raises utils.TimeoutException
+        return
+
+    def set_progress_hook(self, hook):
+        # hook(clique_size, solution) is called now and then during a long solve with the best
+        # clique found in it so far (solution None if there is none yet)
+        return
+
+    def add_integer_constraint(self, var_name: str, constraint_name: str, rhs: float = 1.0):
+        raise NotImplementedError(f'{self.name} backend does not support constraint branching')
+
+    def add_set_constraints(self, var_indexes_list: list, constraint_names: list):
+        raise NotImplementedError(f'{self.name} backend does not support cuts')
+
+    def get_slacks(self, constraint_names: list) -> list:
+        raise NotImplementedError(f'{self.name} backend does not support cuts')
+
+    def remove_constraint(self, constraint_name):
+        raise NotImplementedError(f'{self.name} backend does not support cuts')
+
+
+def make_backend(name: str, graph: nx.Graph, threads: int = None, environment=None,
+                 lazy_pairs: bool = False) -> SolverBackend:
+    # backends are imported on demand so that the native one runs without cplex installed;
+    # environment is a cplex.Cplex object to reuse and lazy_pairs separates the pair rows on
+    # demand, see ProblemHandler (the native backend has no LP rows)
+    assert name in BACKENDS, f'Unknown backend {name}'
+    if name == 'cplex':
+        from problem import ProblemHandler
+        return ProblemHandler(graph=graph, threads=threads, environment=environment, lazy_pairs=lazy_pairs)
+    from native_solver import NativeBackend
+    return NativeBackend(graph=graph)
@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import platform
+import datetime
+import contextlib
+import subprocess
+
+import numpy as np
+import scipy
+from scipy.stats import mannwhitneyu
+
+import utils
+from dimacs import CSRGraph, write_dimacs
+from run_test import run_test
+from benchmarks import EASY, MEDIUM, HARD, SYNTHETIC_SMALL, SYNTHETIC_MEDIUM
+
+FORMAT_VERSION = 1
+TIERS = dict(easy=EASY, medium=MEDIUM, hard=HARD)
+SYNTHETIC_TIERS = {'synthetic-small': SYNTHETIC_SMALL, 'synthetic-medium': SYNTHETIC_MEDIUM}
+# generated stand-ins of the DIMACS tiers when none of their files is there
+FALLBACK_TIERS = dict(easy='synthetic-small', medium='synthetic-medium', hard='synthetic-medium')
+SYNTHETIC_FOLDER = 'benchmarks/synthetic/'
+METRICS = ('build_time_seconds', 'heuristic_time_seconds', 'bnb_exec_time_seconds', 'bnb_call_count',
+           'nodes_per_second', 'build_constraints')
+HIGHER_IS_BETTER = ('nodes_per_second',)
+
+
+def gnp_graph(n: int, p: float, seed: int) -> CSRGraph:
+    rng = np.random.default_rng(seed)
+    rows, cols = np.triu_indices(n, k=1)
+    keep = rng.random(len(rows)) < p
+    return CSRGraph.from_edges(n, np.stack([rows[keep], cols[keep]], axis=1))
+
+
+def planted_clique_graph(n: int, p: float, k: int, seed: int) -> CSRGraph:
+    # G(n, p) plus all edges among k random vertices
+    rng = np.random.default_rng(seed)
+    rows, cols = np.triu_indices(n, k=1)
+    keep = rng.random(len(rows)) < p
+    members = np.zeros(n, dtype=np.bool_)
+    members[rng.choice(n, size=k, replace=False)] = True
+    keep |= members[rows] & members[cols]
+    return CSRGraph.from_edges(n, np.stack([rows[keep], cols[keep]], axis=1))
+
+
+def synthetic_instance(spec: dict, folder: str = SYNTHETIC_FOLDER) -> str:
+    # DIMACS file of a generator spec, written once and reused by later runs
+    name = f'{spec["kind"]}_n{spec["n"]}_p{spec["p"]}'
+    if spec['kind'] == 'planted':
+        name += f'_k{spec["k"]}'
+    file_path = os.path.join(folder, f'{name}_s{spec["seed"]}.clq')
+    if not os.path.exists(file_path):
+        os.makedirs(folder, exist_ok=True)
+        if spec['kind'] == 'gnp':
+            graph = gnp_graph(spec['n'], spec['p'], spec['seed'])
+        else:
+            graph = planted_clique_graph(spec['n'], spec['p'], spec['k'], spec['seed'])
+        write_dimacs(file_path, graph, comment=json.dumps(spec))
+    return file_path
+
+
+def tier_instances(tier: str) -> dict:
+    # file path -> known clique size (None if unknown)
+    if tier in SYNTHETIC_TIERS:
+        return {synthetic_instance(spec): None for spec in SYNTHETIC_TIERS[tier]}
+    instances = {file_path: size for file_path, size in TIERS[tier].items() if os.path.exists(file_path)}
+    missing = len(TIERS[tier]) - len(instances)
+    if missing:
+        print(f'{missing} of {len(TIERS[tier])} {tier} files are missing')
+    if not instances:
+        print(f'Running {FALLBACK_TIERS[tier]} instead of {tier}')
+        return tier_instances(FALLBACK_TIERS[tier])
+    return instances
+
+
+def run_trials(file_path: str, trials: int, seed: int, quiet: bool = True, **kwargs) -> list:
+    # trial t runs with seed + t, so every run of the suite solves the same searches
+    results = []
+    for trial in range(trials):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            result = run_test(file_path, seed=seed + trial, **kwargs)
+        metrics = {metric: result.get(metric) for metric in METRICS if metric in result}
+        metrics['nodes_per_second'] = result['bnb_call_count'] / max(result['bnb_exec_time_seconds'], 1e-9)
+        metrics.update(seed=seed + trial, clique_size=result['bnb_clique_size'],
+                       timed_out=result['bnb_timed_out'])
+        results.append(metrics)
+    return results
+
+
+def summarize(values: list) -> dict:
+    values = np.asarray([value for value in values if value is not None], dtype=float)
+    if len(values) == 0:
+        return dict(n=0)
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    return dict(n=len(values), median=float(median), q1=float(q1), q3=float(q3), iqr=float(q3 - q1))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(tier: str, trials: int = 5, seed: int = 0, **kwargs) -> dict:
+    report = dict(format_version=FORMAT_VERSION,
+                  created=datetime.datetime.now().isoformat(timespec='seconds'),
+                  git_commit=git_commit(),
+                  environment=dict(python=platform.python_version(), numpy=np.__version__,
+                                   scipy=scipy.__version__, platform=platform.platform(),
+                                   cpu_count=os.cpu_count()),
+                  config=dict(tier=tier, trials=trials, seed=seed, **kwargs),
+                  instances=dict())
+    for file_path, true_clique_size in tier_instances(tier).items():
+        results = run_trials(file_path, trials, seed, **kwargs)
+        summary = {metric: summarize([result.get(metric) for result in results]) for metric in METRICS}
+        report['instances'][os.path.basename(file_path)] = dict(
+            file_path=file_path, true_clique_size=true_clique_size, trials=results, summary=summary)
+        print(f'{os.path.basename(file_path)}: ' + ' '.join(
+            f'{metric}={summary[metric]["median"]:.4g}±{summary[metric]["iqr"]:.2g}'
+            for metric in METRICS if summary[metric]['n']))
+    return report
+
+
+def save_report(report: dict, file_path: str):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(report, file, indent=1, default=lambda value: value.item())
+    os.replace(tmp_path, file_path)
+
+
+def load_report(file_path: str) -> dict:
+    with open(file_path) as file:
+        report = json.load(file)
+    if report.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f'{file_path}: unsupported report version {report.get("format_version")}')
+    return report
+
+
+def compare(baseline: dict, current: dict, alpha: float = 0.05, min_change: float = 0.05) -> list:
+    # one-sided Mann-Whitney U test per instance and metric; a regression is a significant
+    # change of the median by more than min_change in the bad direction
+    rows = []
+    for name, instance in current['instances'].items():
+        if name not in baseline['instances']:
+            continue
+        for metric in METRICS:
+            before = [trial[metric] for trial in baseline['instances'][name]['trials'] if trial.get(metric) is not None]
+            after = [trial[metric] for trial in instance['trials'] if trial.get(metric) is not None]
+            if len(before) < 2 or len(after) < 2:
+                continue
+            higher_is_better = metric in HIGHER_IS_BETTER
+            p_value = mannwhitneyu(after, before, alternative='less' if higher_is_better else 'greater').pvalue
+            ratio = np.median(after) / max(np.median(before), 1e-12)
+            worse = ratio < 1 - min_change if higher_is_better else ratio > 1 + min_change
+            rows.append(dict(instance=name, metric=metric, baseline_median=float(np.median(before)),
+                             current_median=float(np.median(after)), ratio=float(ratio),
+                             p_value=float(p_value), regression=bool(worse and p_value < alpha)))
+    return rows
+
+
+def print_comparison(rows: list):
+    for row in rows:
+        flag = 'REGRESSION' if row['regression'] else ''
+        print(f'{row["instance"]:<32} {row["metric"]:<24} {row["baseline_median"]:>12.4g} '
+              f'{row["current_median"]:>12.4g} {row["ratio"]:>7.2f}x p={row["p_value"]:.3f} {flag}')
+
+
+if __name__ == '__main__':
+    args = utils.bench_arg_parser()
+    report = run_suite(args.tier, trials=args.trials, seed=args.seed, time_limit=args.time_limit,
+                       backend=args.backend, node_selection=args.node_selection,
+                       branching_rule=args.branching_rule, lazy_pairs=args.lazy_pairs)
+    output = args.output or f'results/bench_{args.tier}_{report["created"].replace(":", "")}.json'
+    save_report(report, output)
+    print(f'Saved to {output}')
+    if args.baseline:
+        rows = compare(load_report(args.baseline), report, alpha=args.alpha, min_change=args.min_change)
+        print_comparison(rows)
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
@@ -37,3 +37,20 @@ HARD = {
     'benchmarks/DIMACS_all_ascii/p_hat1500-1.clq': 12,
     'benchmarks/DIMACS_all_ascii/p_hat300-3.clq': 36,
 }
+
+# generated instances (see bench.py): G(n, p) and G(n, p) with a planted clique of size k.
+# The small ones take 40 to 1300 B&B nodes, sparser or smaller graphs are solved by the
+# heuristic and the reduction before B&B starts and would only time noise
+SYNTHETIC_SMALL = [
+    dict(kind='gnp', n=60, p=0.7, seed=0),
+    dict(kind='gnp', n=75, p=0.9, seed=0),
+    dict(kind='gnp', n=80, p=0.9, seed=0),
+    dict(kind='planted', n=90, p=0.8, k=22, seed=0),
+]
+
+SYNTHETIC_MEDIUM = [
+    dict(kind='gnp', n=125, p=0.9, seed=0),
+    dict(kind='gnp', n=200, p=0.5, seed=0),
+    dict(kind='gnp', n=150, p=0.7, seed=0),
+    dict(kind='planted', n=200, p=0.5, k=20, seed=0),
+]
@@ -0,0 +1,103 @@
+import numpy as np
+import networkx as nx
+
+import utils
+
+
+class BitGraph:
+    # adjacency of every vertex packed into a python int; bit k stands for the k-th vertex
+    # in non-increasing degree order (the initial ordering of MCS/Tomita coloring)
+
+    def __init__(self, graph: nx.Graph):
+        # graph is nx.Graph or dimacs.CSRGraph
+        adjacency = utils.adjacency_matrix(graph)
+        self.num_of_nodes = adjacency.shape[0]
+        degrees = np.diff(adjacency.indptr)
+        # var index (node - 1) <-> bit position
+        order = np.lexsort((np.arange(self.num_of_nodes), -degrees))
+        self.index_of_bit = order.tolist()
+        self.bit_of_index = [0] * self.num_of_nodes
+        for bit, var_index in enumerate(self.index_of_bit):
+            self.bit_of_index[var_index] = bit
+        permuted = adjacency[order][:, order].tocsr()
+        self.adjacency = [self.pack(permuted.indices[permuted.indptr[bit]:permuted.indptr[bit + 1]])
+                          for bit in range(self.num_of_nodes)]
+        self.all_nodes = (1 << self.num_of_nodes) - 1
+
+    @staticmethod
+    def pack(bits: np.ndarray) -> int:
+        if len(bits) == 0:
+            return 0
+        row = np.zeros(int(bits.max()) + 1, dtype=np.bool_)
+        row[bits] = True
+        return int.from_bytes(np.packbits(row, bitorder='little').tobytes(), 'little')
+
+    def mask(self, var_index: int) -> int:
+        return 1 << self.bit_of_index[var_index]
+
+    def to_mask(self, var_indexes) -> int:
+        mask = 0
+        for var_index in var_indexes:
+            mask |= 1 << self.bit_of_index[var_index]
+        return mask
+
+    def to_var_indexes(self, mask: int) -> list:
+        var_indexes = []
+        while mask:
+            low = mask & -mask
+            var_indexes.append(self.index_of_bit[low.bit_length() - 1])
+            mask ^= low
+        return sorted(var_indexes)
+
+    def common_neighbors(self, mask: int) -> int:
+        # vertices adjacent to every vertex of mask
+        common = self.all_nodes
+        while mask:
+            low = mask & -mask
+            common &= self.adjacency[low.bit_length() - 1]
+            mask ^= low
+        return common
+
+    def is_clique(self, mask: int) -> bool:
+        rest = mask
+        while rest:
+            low = rest & -rest
+            rest ^= low
+            if rest & ~self.adjacency[low.bit_length() - 1]:
+                return False
+        return True
+
+    def coloring_bound(self, candidates: int, limit: int = None) -> int:
+        # greedy sequential coloring of candidates: each color class is an independent set,
+        # so the number of colors bounds the size of any clique within candidates.
+        # stops as soon as the number of colors exceeds limit (bound is useless anyway)
+        colors = 0
+        uncolored = candidates
+        adjacency = self.adjacency
+        while uncolored:
+            colors += 1
+            if limit is not None and colors > limit:
+                return colors
+            available = uncolored
+            while available:
+                low = available & -available
+                uncolored ^= low
+                available &= ~(adjacency[low.bit_length() - 1] | low)
+        return colors
+
+    def sequential_coloring(self, var_order: list) -> list:
+        # color of every var index, vars colored greedily in the given order
+        colors = [0] * self.num_of_nodes
+        color_classes = []
+        for var_index in var_order:
+            bit = self.bit_of_index[var_index]
+            adjacency = self.adjacency[bit]
+            for color, color_class in enumerate(color_classes):
+                if not color_class & adjacency:
+                    color_classes[color] |= 1 << bit
+                    break
+            else:
+                color = len(color_classes)
+                color_classes.append(1 << bit)
+            colors[var_index] = color
+        return colors
@@ -1,16 +1,36 @@
-import cplex
 import time
 import numpy as np
 from math import isclose
 
 import utils
-from problem import ProblemHandler
+from bitset import BitGraph
+from backend import SolverBackend
+from node_queue import Node, NodeQueue
+from cuts import CutPool
+from symmetry import Symmetry
+from checkpoint import graph_digest, save_checkpoint
+from profiling import Profiler, NULL_PROFILER
 
 
 class BranchAndBound:
+    BRANCHING_RULES = ('closest_to_one', 'most_fractional', 'pseudo_cost', 'degree_weighted')
 
-    def __init__(self, problem: ProblemHandler, initial_obj_value: float, initial_solution: list,
-                 abs_tol: float = 1e-4, time_limit: int = None):
+    def __init__(self, problem: SolverBackend, initial_obj_value: float, initial_solution: list,
+                 abs_tol: float = 1e-4, time_limit: int = None, branching: str = 'bounds',
+                 node_selection: str = None, max_open_nodes: int = None, dive_period: int = 100,
+                 separate_cuts: bool = False, cut_max_age: int = 10, cut_rounds: int = 5,
+                 incumbent=None, progress_callback=None, progress_interval: float = 1.0,
+                 checkpoint_path: str = None, checkpoint_interval: float = 10.0,
+                 checkpoint_extra: dict = None, resume_state: dict = None, profiler: Profiler = None,
+                 branching_rule: str = 'closest_to_one', symmetry: Symmetry = None):
+        assert branching in ('bounds', 'constraints')
+        assert branching_rule in self.BRANCHING_RULES, f'Unknown branching rule: {branching_rule}'
+        # the frontier of the recursive search lives on the call stack, checkpoints need the node queue
+        if (checkpoint_path or resume_state) and node_selection is None:
+            node_selection = 'dfs'
+        assert node_selection is None or branching == 'bounds', 'Node queue requires bound branching'
+        assert problem.supports_rows or branching == 'bounds', f'{problem.name} backend requires bound branching'
+        assert problem.supports_rows or not separate_cuts, f'{problem.name} backend does not support cuts'
         self.call_counter = 0
         self.recursion_depth = 0
         self.max_recursion_depth = 0
@@ -20,80 +40,540 @@ class BranchAndBound:
         self.num_of_nodes = problem.graph.number_of_nodes()
         self.constrained_vars = np.zeros(self.num_of_nodes, dtype=np.bool)
         self.constraint_size = 0
+        # bitsets of vars fixed to one/zero by branching, used by the coloring bound
+        self.bit_graph = BitGraph(problem.graph)
+        self.fixed_ones = 0
+        self.fixed_zeros = 0
+        self.coloring_pruned = 0
+        self.lp_pruned = 0
         self.abs_tol = abs_tol
         self.start_time = None
         self.time_limit = time_limit
+        # 'bounds' fixes branching vars through their bounds and re-solves from the parent's basis,
+        # 'constraints' adds and deletes an equality row per branch
+        self.branching = branching
+        self.node_lp_iterations = []
+        # None keeps the recursive depth-first search, otherwise one of NodeQueue.STRATEGIES
+        self.node_selection = node_selection
+        self.max_open_nodes = max_open_nodes
+        self.dive_period = dive_period
+        self.max_queue_size = 0
+        # independent set cuts separated after every LP solve (branch-and-cut)
+        self.cut_pool = CutPool(self.bit_graph, max_age=cut_max_age, abs_tol=abs_tol) if separate_cuts else None
+        self.cut_rounds = cut_rounds
+        self.separation_time = 0.0
+        # multiprocessing.Value with the clique size shared by parallel searches
+        self.incumbent = incumbent
+        # progress_callback(event) is called every progress_interval seconds with the incumbent,
+        # the global upper bound and the search rate
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.last_progress = None
+        # backends searching a whole subtree in one solve report from inside it
+        if progress_callback is not None:
+            problem.set_progress_hook(self.on_solve_progress)
+        # bounds of the unexplored part of the tree: the node in process, the LP values of the
+        # recursion frames (or the open nodes of the queue) and the root bound
+        self.current_bound = self.num_of_nodes
+        self.open_bounds = []
+        self.pending_branches = 0
+        self.queue = None
+        self.root_bound = self.num_of_nodes
+        # nodes the solver failed on are left unsearched, the largest of their bounds stays open
+        self.unsolved_nodes = 0
+        self.unsolved_bound = 0
+        self.timed_out = False
+        self.upper_bound = None
+        # the open nodes, incumbent, counters and cuts are written to checkpoint_path every
+        # checkpoint_interval seconds (and on timeout); checkpoint_extra is stored along as is
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_extra = checkpoint_extra
+        self.graph_digest = graph_digest(problem.graph) if checkpoint_path or resume_state else None
+        self.last_checkpoint = None
+        self.checkpoints_written = 0
+        self.checkpoint_time = 0.0
+        # search time of the runs before the checkpoint this one was resumed from
+        self.resume_state = resume_state
+        self.resumed_elapsed = 0.0
+        # per-phase timings, a no-op unless an enabled profiler is given
+        self.profiler = profiler or NULL_PROFILER
+        # how select_branching_var scores the free vars, see BRANCHING_RULES
+        self.branching_rule = branching_rule
+        self.degrees = np.diff(utils.adjacency_matrix(problem.graph).indptr)
+        # pseudo costs: summed LP value decrease per unit of var change, down (row 0) and up (row 1)
+        # branches; pending_branch is the (var index, value, LP value, parent LP) of the node in process
+        self.pseudo_costs = np.zeros((2, self.num_of_nodes))
+        self.pseudo_counts = np.zeros((2, self.num_of_nodes), dtype=np.int64)
+        self.pending_branch = None
+        # vertex symmetries of the graph: the zero branch of a var also fixes its orbit (at the root)
+        # or its free twins (below) to zero, see orbital_zeros
+        self.symmetry = symmetry
+        self.orbit_masks = dict()
+        self.twin_masks = dict()
+        if symmetry is not None:
+            for orbit in symmetry.orbit_classes():
+                mask = self.bit_graph.to_mask(orbit)
+                self.orbit_masks.update((var_index, mask) for var_index in orbit)
+            for twins in symmetry.twins:
+                mask = self.bit_graph.to_mask(twins)
+                self.twin_masks.update((var_index, mask) for var_index in twins)
+        self.orbital_fixings = 0
 
     @utils.timer
     def timed_run(self):
+        # stops at time_limit with the best clique found so far and the proven upper bound
+        self.start_time = time.perf_counter()
+        try:
+            if self.node_selection is None:
+                self.run()
+            elif self.resume_state is not None:
+                self.run_iterative(self.restore(self.resume_state))
+            else:
+                self.run_iterative()
+            self.upper_bound = max(self.unsolved_upper_bound(), self.best_obj_value)
+        except utils.TimeoutException as timeout:
+            self.on_timeout(timeout)
+        if self.progress_callback is not None:
+            self.emit_progress(time.perf_counter())
+        return
+
+    def on_timeout(self, timeout: utils.TimeoutException):
+        print(timeout.msg)
+        self.timed_out = True
+        # a backend interrupted in the middle of a solve may hand over a better clique
+        solution = timeout.best_solution
+        if solution is not None and round(sum(solution)) > self.best_obj_value:
+            clique_nodes = utils.to_node_indexes(solution, abs_tol=self.abs_tol)
+            if self.bit_graph.is_clique(self.bit_graph.to_mask(node - 1 for node in clique_nodes)):
+                self.best_obj_value, self.best_solution = round(sum(solution)), solution
+        self.upper_bound = self.global_upper_bound()
+        return
+
+    @property
+    def gap(self) -> float:
+        # relative optimality gap, (upper bound - incumbent) / incumbent
+        if self.upper_bound is None:
+            return None
+        return (self.upper_bound - self.best_obj_value) / max(self.best_obj_value, 1)
+
+    def global_upper_bound(self) -> int:
+        # no clique in the unexplored part of the tree is larger than this
+        if self.queue is not None:
+            open_bounds = [node.bound for node in self.queue.open_nodes()]
+        else:
+            open_bounds = self.open_bounds
+        upper_bound = min(max([self.current_bound, self.unsolved_bound] + open_bounds), self.root_bound)
+        return max(int(upper_bound + self.abs_tol), self.best_obj_value)
+
+    def unsolved_upper_bound(self) -> int:
+        # bound of the subtrees of the nodes the solver failed on, 0 if there are none
+        if self.unsolved_nodes == 0:
+            return 0
+        return int(min(self.unsolved_bound, self.root_bound) + self.abs_tol)
+
+    def leave_unsolved(self, error: Exception, bound: float):
+        # the subtree of the node is not searched, its bound keeps the upper bound honest
+        print(f'Node left unsolved: {error}')
+        self.unsolved_nodes += 1
+        self.unsolved_bound = max(self.unsolved_bound, bound)
+
+    def check_time(self):
+        # called before every node solve: cheap clock read, progress events and the deadline
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = now
+        if self.progress_callback is not None:
+            if self.last_progress is None:
+                self.last_progress = (self.start_time, 0)
+            if now - self.last_progress[0] >= self.progress_interval:
+                self.emit_progress(now)
         if self.time_limit:
-            self.start_time = time.perf_counter()
-        self.run()
+            elapsed_time = now - self.start_time
+            if elapsed_time > self.time_limit:
+                raise utils.TimeoutException(best_clique_size=self.best_obj_value,
+                                             msg=f'TIMEOUT: >{round(elapsed_time)}s elapsed')
+            self.problem.set_time_limit(self.time_limit - elapsed_time)
         return
 
-    def run(self):
+    def emit_progress(self, now: float):
+        last_time, last_counter = self.last_progress or (self.start_time, 0)
+        best_solution = self.best_solution if self.best_obj_value > 0 else None
+        self.progress_callback(dict(
+            elapsed=now - self.start_time,
+            incumbent=self.best_obj_value,
+            clique=utils.to_node_indexes(best_solution, abs_tol=self.abs_tol) if best_solution else [],
+            upper_bound=self.global_upper_bound() if self.upper_bound is None else self.upper_bound,
+            open_nodes=len(self.queue) if self.queue is not None else self.pending_branches,
+            nodes=self.call_counter,
+            nodes_per_second=(self.call_counter - last_counter) / max(now - last_time, 1e-9),
+        ))
+        self.last_progress = (now, self.call_counter)
+        return
+
+    def on_solve_progress(self, clique_size: int, solution: list):
+        # progress hook of the backend: takes over a better clique of the running solve and
+        # emits the events check_time cannot while the solve lasts
+        now = time.perf_counter()
+        if now - self.last_progress[0] < self.progress_interval:
+            return
+        if solution is not None and clique_size > self.best_obj_value:
+            self.best_obj_value, self.best_solution = clique_size, solution
+            if self.incumbent is not None:
+                with self.incumbent.get_lock():
+                    self.incumbent.value = max(self.incumbent.value, self.best_obj_value)
+        self.emit_progress(now)
+        return
+
+    def process_node(self):
+        # solve the current node, returns its LP value and solution if it has to be branched on
         self.call_counter += 1
+        if self.incumbent is not None and self.incumbent.value > self.best_obj_value:
+            self.best_obj_value = self.incumbent.value
+        self.check_time()
+        pending_branch, self.pending_branch = self.pending_branch, None
+        profiler = self.profiler
+        profiler.record('node_depth', self.recursion_depth)
+        is_root = self.fixed_ones == 0 and self.fixed_zeros == 0
+        with profiler.phase('coloring_bound'):
+            coloring_bound = self.coloring_bound()
+        if is_root:
+            # the pruning bound stops counting colors past the incumbent, the root needs all of them
+            self.root_bound = min(self.root_bound, self.bit_graph.coloring_bound(self.bit_graph.all_nodes))
+        if coloring_bound <= self.best_obj_value:
+            self.coloring_pruned += 1
+            return None
         try:
-            current_obj_value = self.problem.solve_problem()
-        except cplex.exceptions.CplexSolverError as error:
-            print(error)
-            return
+            with profiler.phase('lp_solve', histogram=True):
+                current_obj_value = self.problem.solve_problem(lower_bound=self.best_obj_value)
+        except self.problem.SolverError as error:
+            self.leave_unsolved(error, self.current_bound)
+            return None
+        self.node_lp_iterations.append(self.problem.get_num_iterations())
+        if pending_branch is not None:
+            self.update_pseudo_costs(pending_branch, current_obj_value)
+        current_solution = None
+        if self.cut_pool is not None:
+            try:
+                with profiler.phase('cut_separation'):
+                    current_obj_value, current_solution = self.separate_cuts(current_obj_value)
+            except self.problem.SolverError as error:
+                # the LP value without the cuts still bounds the node
+                self.leave_unsolved(error, current_obj_value)
+                return None
+        if is_root:
+            self.root_bound = min(self.root_bound, current_obj_value)
         if int(current_obj_value + self.abs_tol) <= self.best_obj_value:
-            return
-        current_solution = self.problem.get_solution()
-        if self.is_all_integer(current_solution, abs_tol=self.abs_tol):
-            clique_nodes = utils.to_node_indexes(current_solution, abs_tol=self.abs_tol)
-            is_clique = utils.is_clique(self.problem.graph, clique_nodes)
+            self.lp_pruned += 1
+            return None
+        if current_solution is None:
+            with profiler.phase('get_solution'):
+                current_solution = self.problem.get_solution_array()
+        with profiler.phase('integrality_check'):
+            is_all_integer = self.is_all_integer(current_solution, abs_tol=self.abs_tol)
+        if is_all_integer:
+            with profiler.phase('clique_check'):
+                clique_indexes = np.flatnonzero(current_solution > 0.5).tolist()
+                is_clique = self.bit_graph.is_clique(self.bit_graph.to_mask(clique_indexes))
             if not is_clique:
-                return
+                return None
             print(f'Found new best: {round(current_obj_value)}')
-            self.best_solution = current_solution
+            self.best_solution = current_solution.tolist()
             self.best_obj_value = round(current_obj_value)
-            return
+            if self.incumbent is not None:
+                with self.incumbent.get_lock():
+                    self.incumbent.value = max(self.incumbent.value, self.best_obj_value)
+            return None
+        return current_obj_value, current_solution
 
-        if self.time_limit:
-            elapsed_time = time.perf_counter() - self.start_time
-            if elapsed_time > self.time_limit:
-                raise utils.TimeoutException(best_clique_size=self.best_obj_value,
-                                             msg=f'TIMEOUT: >{round(elapsed_time)}s elapsed')
-
-        branching_var_index = self.select_branching_var(current_solution)
+    def run(self):
+        self.current_bound = self.open_bounds[-1] if self.open_bounds else self.num_of_nodes
+        processed = self.process_node()
+        if processed is None:
+            return
+        current_obj_value, current_solution = processed
+        with self.profiler.phase('branching'):
+            branching_var_index = self.select_branching_var(current_solution)
         if branching_var_index is None:
             return
         branching_var_name = f'x{branching_var_index + 1}'
-        rounded_value = round(current_solution[branching_var_index])
-        for branch_value in [rounded_value, 1 - round(rounded_value)]:
-            constraint_name = f'C{self.call_counter}_branch{branch_value}_{branching_var_name}'
-            self.problem.add_integer_constraint(var_name=branching_var_name, rhs=branch_value,
-                                                constraint_name=constraint_name)
+        branching_var_value = float(current_solution[branching_var_index])
+        rounded_value = round(branching_var_value)
+        parent_basis = self.problem.get_basis() if self.branching == 'bounds' else None
+        symmetric_zeros = self.orbital_zeros(branching_var_index, self.fixed_ones, self.fixed_zeros)
+        symmetric_indexes = self.bit_graph.to_var_indexes(symmetric_zeros)
+        self.open_bounds.append(current_obj_value)
+        self.pending_branches += 1
+        for branch_number, branch_value in enumerate([rounded_value, 1 - round(rounded_value)]):
+            if branch_number > 0:
+                self.pending_branches -= 1
+            if self.branching == 'bounds':
+                # the first branch starts from the basis just computed for this node
+                if branch_number > 0:
+                    self.problem.set_basis(parent_basis)
+                self.problem.fix_variables([branching_var_index], branch_value)
+            else:
+                constraint_name = f'C{self.call_counter}_branch{branch_value}_{branching_var_name}'
+                self.problem.add_integer_constraint(var_name=branching_var_name, rhs=branch_value,
+                                                    constraint_name=constraint_name)
             self.constrained_vars[branching_var_index] = 1
             self.constraint_size += 1
+            if branch_value == 1:
+                self.fixed_ones |= self.bit_graph.mask(branching_var_index)
+            else:
+                self.fixed_zeros |= self.bit_graph.mask(branching_var_index) | symmetric_zeros
+                if symmetric_zeros:
+                    self.problem.fix_variables(symmetric_indexes, 0.0)
+                    self.constrained_vars[symmetric_indexes] = 1
+                    self.orbital_fixings += len(symmetric_indexes)
             self.recursion_depth += 1
             self.max_recursion_depth = max(self.recursion_depth, self.max_recursion_depth)
+            self.pending_branch = (branching_var_index, branch_value, branching_var_value, current_obj_value)
             self.run()
-            self.problem.remove_constraint(constraint_name)
+            if self.branching == 'constraints':
+                self.problem.remove_constraint(constraint_name)
             self.constrained_vars[branching_var_index] = 0
             self.constraint_size -= 1
+            self.fixed_ones &= ~self.bit_graph.mask(branching_var_index)
+            self.fixed_zeros &= ~(self.bit_graph.mask(branching_var_index) | symmetric_zeros)
+            if branch_value == 0 and symmetric_zeros:
+                self.problem.restore_bounds(symmetric_indexes)
+                self.constrained_vars[symmetric_indexes] = 0
             self.recursion_depth -= 1
+        self.open_bounds.pop()
+        if self.branching == 'bounds':
+            self.problem.restore_bounds([branching_var_index])
+        return
+
+    def run_iterative(self, nodes: list = None, open_nodes_limit: int = None, on_node=None) -> list:
+        # explores the given open nodes (the root if None); stops early once open_nodes_limit nodes
+        # are open and returns the nodes left open. on_node(queue) is called before every selection
+        queue = NodeQueue(strategy=self.node_selection or 'dfs', max_open_nodes=self.max_open_nodes,
+                          dive_period=self.dive_period)
+        self.queue = queue
+        queue.push([Node(fixed_ones=0, fixed_zeros=0, bound=self.num_of_nodes)] if nodes is None else nodes)
+        self.last_checkpoint = time.perf_counter()
+        node = None
+        try:
+            while len(queue) > 0:
+                if open_nodes_limit and len(queue) >= open_nodes_limit:
+                    break
+                if self.checkpoint_path and time.perf_counter() - self.last_checkpoint >= self.checkpoint_interval:
+                    with self.profiler.phase('checkpoint'):
+                        self.save_checkpoint(queue.ordered_nodes())
+                if on_node is not None:
+                    on_node(queue)
+                    if len(queue) == 0:
+                        break
+                node = queue.pop()
+                self.current_bound = node.bound
+                if int(node.bound + self.abs_tol) <= self.best_obj_value:
+                    self.lp_pruned += 1
+                    continue
+                with self.profiler.phase('set_fixings'):
+                    self.set_fixings(node.fixed_ones, node.fixed_zeros)
+                self.recursion_depth = node.depth
+                self.pending_branch = node.branch
+                self.max_recursion_depth = max(self.recursion_depth, self.max_recursion_depth)
+                processed = self.process_node()
+                if processed is None:
+                    continue
+                current_obj_value, current_solution = processed
+                with self.profiler.phase('branching'):
+                    branching_var_index = self.select_branching_var(current_solution)
+                if branching_var_index is None:
+                    continue
+                mask = self.bit_graph.mask(branching_var_index)
+                branching_var_value = float(current_solution[branching_var_index])
+                rounded_value = round(branching_var_value)
+                # best-estimate: LP value minus the total distance of vars to integrality
+                estimate = current_obj_value - float(np.minimum(current_solution, 1 - current_solution).sum())
+                symmetric_zeros = self.orbital_zeros(branching_var_index, node.fixed_ones, node.fixed_zeros)
+                children = []
+                for branch_value in [rounded_value, 1 - rounded_value]:
+                    if branch_value == 1:
+                        fixed_ones, fixed_zeros = node.fixed_ones | mask, node.fixed_zeros
+                    else:
+                        fixed_ones, fixed_zeros = node.fixed_ones, node.fixed_zeros | mask | symmetric_zeros
+                        self.orbital_fixings += bin(symmetric_zeros).count('1')
+                    children.append(Node(fixed_ones=fixed_ones, fixed_zeros=fixed_zeros,
+                                         bound=current_obj_value, estimate=estimate,
+                                         depth=node.depth + 1,
+                                         branch=(branching_var_index, branch_value, branching_var_value,
+                                                 current_obj_value)))
+                queue.push(children)
+                self.max_queue_size = max(queue.max_size, self.max_queue_size)
+        except utils.TimeoutException:
+            # the node in process is still open
+            if self.checkpoint_path:
+                self.save_checkpoint(([node] if node is not None else []) + queue.ordered_nodes())
+            raise
+        finally:
+            self.set_fixings(0, 0)
+        if self.checkpoint_path and not open_nodes_limit:
+            self.save_checkpoint([])
+        return queue.open_nodes()
+
+    def save_checkpoint(self, open_nodes: list):
+        tic = time.perf_counter()
+        best_solution = self.best_solution
+        counters = dict(call_counter=self.call_counter, max_recursion_depth=self.max_recursion_depth,
+                        coloring_pruned=self.coloring_pruned, lp_pruned=self.lp_pruned,
+                        max_queue_size=self.max_queue_size, separation_time=self.separation_time,
+                        root_bound=self.root_bound, pseudo_costs=self.pseudo_costs,
+                        pseudo_counts=self.pseudo_counts, orbital_fixings=self.orbital_fixings,
+                        unsolved_nodes=self.unsolved_nodes, unsolved_bound=self.unsolved_bound)
+        save_checkpoint(self.checkpoint_path, dict(
+            graph_digest=self.graph_digest,
+            nodes=[(node.fixed_ones, node.fixed_zeros, node.bound, node.estimate, node.depth)
+                   for node in open_nodes],
+            best_obj_value=self.best_obj_value,
+            best_solution=[i for i, value in enumerate(best_solution) if value > 0.5] if best_solution else None,
+            counters=counters,
+            node_lp_iterations=np.asarray(self.node_lp_iterations, dtype=np.int32),
+            elapsed=self.resumed_elapsed + tic - self.start_time,
+            random_state=np.random.get_state(),
+            cuts=self.cut_pool.state() if self.cut_pool is not None else None,
+            extra=self.checkpoint_extra,
+        ))
+        self.checkpoints_written += 1
+        self.last_checkpoint = time.perf_counter()
+        self.checkpoint_time += self.last_checkpoint - tic
         return
 
-    def select_branching_var(self, solution: list) -> int:
-        selected_var_index = None
-        min_diff_to_int = 2
-        for _index, value in enumerate(solution):
-            if self.constrained_vars[_index] != 1:
-                diff_to_int = abs(1 - value)
-                if diff_to_int <= min_diff_to_int:
-                    min_diff_to_int = diff_to_int
-                    selected_var_index = _index
-        return selected_var_index
+    def restore(self, state: dict) -> list:
+        # continue from a checkpoint: returns its open nodes
+        if state['graph_digest'] != self.graph_digest:
+            raise ValueError('Checkpoint was written for another graph')
+        if state['best_obj_value'] > self.best_obj_value:
+            self.best_obj_value = state['best_obj_value']
+            self.best_solution = [0.0] * self.num_of_nodes
+            for var_index in state['best_solution']:
+                self.best_solution[var_index] = 1.0
+        for key, value in state['counters'].items():
+            setattr(self, key, value)
+        self.node_lp_iterations = state['node_lp_iterations'].tolist()
+        self.resumed_elapsed = state['elapsed']
+        np.random.set_state(state['random_state'])
+        if self.cut_pool is not None and state['cuts'] is not None:
+            cuts = self.cut_pool.restore(state['cuts'])
+            if cuts:
+                names, var_indexes_list = zip(*cuts)
+                self.problem.add_set_constraints(list(var_indexes_list), list(names))
+        print(f'Resumed with {len(state["nodes"])} open nodes, best {self.best_obj_value}')
+        return [Node(fixed_ones=fixed_ones, fixed_zeros=fixed_zeros, bound=bound, estimate=estimate, depth=depth)
+                for fixed_ones, fixed_zeros, bound, estimate, depth in state['nodes']]
+
+    def separate_cuts(self, current_obj_value: float) -> tuple:
+        # tighten the node LP with violated independent set rows, then age out slack rows;
+        # returns the final LP value and solution (removing rows discards the CPLEX solution)
+        tic = time.perf_counter()
+        current_solution = self.problem.get_solution_array()
+        for _ in range(self.cut_rounds):
+            if int(current_obj_value + self.abs_tol) <= self.best_obj_value:
+                break
+            if self.is_all_integer(current_solution, abs_tol=self.abs_tol):
+                break
+            cuts = self.cut_pool.separate(current_solution)
+            if not cuts:
+                break
+            names, var_indexes_list = zip(*cuts)
+            self.problem.add_set_constraints(list(var_indexes_list), list(names))
+            current_obj_value = self.problem.solve_problem()
+            current_solution = self.problem.get_solution_array()
+            self.node_lp_iterations[-1] += self.problem.get_num_iterations()
+        names = self.cut_pool.names()
+        if names:
+            expired = self.cut_pool.update_ages(names, self.problem.get_slacks(names))
+            if expired:
+                self.problem.remove_constraint(expired)
+        self.separation_time += time.perf_counter() - tic
+        return current_obj_value, current_solution
+
+    def set_fixings(self, fixed_ones: int, fixed_zeros: int):
+        # move the model from the current fixings to the given ones with bulk bound updates
+        released = (self.fixed_ones & ~fixed_ones) | (self.fixed_zeros & ~fixed_zeros)
+        new_ones = fixed_ones & ~self.fixed_ones
+        new_zeros = fixed_zeros & ~self.fixed_zeros
+        released_indexes = self.bit_graph.to_var_indexes(released)
+        new_ones_indexes = self.bit_graph.to_var_indexes(new_ones)
+        new_zeros_indexes = self.bit_graph.to_var_indexes(new_zeros)
+        self.problem.restore_bounds(released_indexes)
+        self.problem.fix_variables(new_ones_indexes, 1.0)
+        self.problem.fix_variables(new_zeros_indexes, 0.0)
+        self.constrained_vars[released_indexes] = 0
+        self.constrained_vars[new_ones_indexes + new_zeros_indexes] = 1
+        self.fixed_ones = fixed_ones
+        self.fixed_zeros = fixed_zeros
+        self.constraint_size = bin(fixed_ones | fixed_zeros).count('1')
+        return
+
+    def coloring_bound(self) -> int:
+        # size of the fixed clique plus the number of colors of the remaining candidates;
+        # a fixed set that is not a clique makes the node infeasible
+        if not self.bit_graph.is_clique(self.fixed_ones):
+            return -1
+        candidates = self.bit_graph.common_neighbors(self.fixed_ones) & ~self.fixed_zeros
+        clique_size = bin(self.fixed_ones).count('1')
+        limit = self.best_obj_value - clique_size
+        return clique_size + self.bit_graph.coloring_bound(candidates, limit=limit)
+
+    def orbital_zeros(self, var_index: int, fixed_ones: int, fixed_zeros: int) -> int:
+        # vars fixed to zero along with var_index in its zero branch: the orbit of var_index at
+        # the root, its free twins below. Any of them in a clique can be swapped for var_index by
+        # a symmetry keeping the fixings, so the one branch covers these cliques (orbital fixing)
+        if self.symmetry is None or self.branching != 'bounds':
+            return 0
+        masks = self.orbit_masks if fixed_ones == 0 and fixed_zeros == 0 else self.twin_masks
+        return masks.get(var_index, 0) & ~(fixed_ones | fixed_zeros | self.bit_graph.mask(var_index))
+
+    def update_pseudo_costs(self, branch: tuple, obj_value: float):
+        var_index, value, lp_value, parent_obj_value = branch
+        change = 1 - lp_value if value == 1 else lp_value
+        if change > self.abs_tol:
+            self.pseudo_costs[value, var_index] += max(parent_obj_value - obj_value, 0) / change
+            self.pseudo_counts[value, var_index] += 1
+        return
+
+    def select_branching_var(self, solution: np.ndarray) -> int:
+        # best scored var that is not fixed yet, ties go to the last one
+        solution = np.asarray(solution, dtype=float)
+        free = ~self.constrained_vars
+        if not free.any():
+            return None
+        if self.branching_rule == 'closest_to_one':
+            scores = -np.abs(1 - solution)
+        else:
+            fractionality = np.minimum(solution, 1 - solution)
+            if self.branching_rule == 'most_fractional':
+                scores = fractionality
+            elif self.branching_rule == 'degree_weighted':
+                # fractional vars of high degree close the most of the LP gap
+                scores = fractionality * (1 + self.degrees)
+            else:
+                scores = self.pseudo_cost_scores(solution)
+            # integer valued free vars only when there is nothing fractional
+            scores = np.where(fractionality > self.abs_tol, scores, -1.0)
+        scores = np.where(free, scores, -np.inf)
+        return int(len(scores) - 1 - np.argmax(scores[::-1]))
+
+    def pseudo_cost_scores(self, solution: np.ndarray) -> np.ndarray:
+        # product of the expected down and up LP decreases; vars never branched on get the
+        # average pseudo cost of the others (1 before any branching)
+        averages = np.empty_like(self.pseudo_costs)
+        for direction in (0, 1):
+            counts = self.pseudo_counts[direction]
+            known = counts > 0
+            default = (self.pseudo_costs[direction][known] / counts[known]).mean() if known.any() else 1.0
+            averages[direction] = np.where(known, self.pseudo_costs[direction] / np.maximum(counts, 1), default)
+        down = averages[0] * solution
+        up = averages[1] * (1 - solution)
+        return np.maximum(down, 1e-6) * np.maximum(up, 1e-6)
 
     @staticmethod
-    def is_all_integer(variables: list, abs_tol: float = 1e-4) -> bool:
-        for var in variables:
-            if not BranchAndBound.is_integer(var, abs_tol=abs_tol):
-                return False
-        return True
+    def is_all_integer(variables: np.ndarray, abs_tol: float = 1e-4) -> bool:
+        variables = np.asarray(variables, dtype=float)
+        return bool(np.all(np.minimum(np.abs(variables), np.abs(1 - variables)) <= abs_tol))
 
     @staticmethod
     def is_integer(var: float, abs_tol: float = 1e-4) -> bool:
@@ -0,0 +1,35 @@
+import os
+import pickle
+import hashlib
+
+import networkx as nx
+
+import utils
+
+CHECKPOINT_VERSION = 1
+
+
+def graph_digest(graph: nx.Graph) -> str:
+    # fixings are bitsets over the var indexes of this very graph
+    adjacency = utils.adjacency_matrix(graph)
+    digest = hashlib.sha1(adjacency.indptr.astype('int64').tobytes())
+    digest.update(adjacency.indices.astype('int32').tobytes())
+    return digest.hexdigest()
+
+
+def save_checkpoint(path: str, state: dict):
+    # written next to the target and renamed over it, a crash leaves the previous checkpoint intact
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(dict(state, version=CHECKPOINT_VERSION), file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> dict:
+    with open(path, 'rb') as file:
+        state = pickle.load(file)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f'{path}: unsupported checkpoint version {state.get("version")}')
+    return state
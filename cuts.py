@@ -0,0 +1,159 @@
+import numpy as np
+import scipy.sparse as sp
+
+from bitset import BitGraph
+
+
+class CutPool:
+    # independent set rows sum(x_i) <= 1 separated from fractional LP solutions;
+    # rows that stay slack for max_age consecutive nodes are dropped from the model
+
+    def __init__(self, bit_graph: BitGraph, max_age: int = 10, max_cuts: int = 50,
+                 abs_tol: float = 1e-4):
+        self.bit_graph = bit_graph
+        self.max_age = max_age
+        self.max_cuts = max_cuts
+        self.abs_tol = abs_tol
+        all_nodes = bit_graph.all_nodes
+        self.non_adjacency = [all_nodes & ~(adjacency | (1 << bit))
+                              for bit, adjacency in enumerate(bit_graph.adjacency)]
+        self.name2mask = dict()
+        self.ages = dict()
+        self.cut_counter = 0
+        self.cuts_added = 0
+        self.cuts_removed = 0
+        self.max_pool_size = 0
+
+    def __len__(self):
+        return len(self.name2mask)
+
+    def separate(self, solution: list) -> list:
+        # grow a maximal independent set from every fractional var, taking vars in order of
+        # decreasing LP value; returns (name, var indexes) of new violated rows
+        index_of_bit = self.bit_graph.index_of_bit
+        weights = np.asarray(solution, dtype=float)[index_of_bit].tolist()
+        positive = [bit for bit in range(len(weights)) if weights[bit] > self.abs_tol]
+        positive.sort(key=lambda bit: -weights[bit])
+        seen = set(self.name2mask.values())
+        cuts = []
+        for seed in positive:
+            if weights[seed] > 1 - self.abs_tol:
+                continue
+            ind_set = 1 << seed
+            allowed = self.non_adjacency[seed]
+            weight = weights[seed]
+            for bit in positive:
+                if allowed >> bit & 1:
+                    ind_set |= 1 << bit
+                    allowed &= self.non_adjacency[bit]
+                    weight += weights[bit]
+            if weight <= 1 + self.abs_tol or ind_set in seen:
+                continue
+            # zero valued vars don't change the violation but make the row stronger
+            while allowed:
+                low = allowed & -allowed
+                ind_set |= low
+                allowed &= self.non_adjacency[low.bit_length() - 1]
+            if ind_set in seen:
+                continue
+            seen.add(ind_set)
+            self.cut_counter += 1
+            name = f'cut{self.cut_counter}'
+            self.name2mask[name] = ind_set
+            self.ages[name] = 0
+            cuts.append((name, self.bit_graph.to_var_indexes(ind_set)))
+            if len(cuts) >= self.max_cuts:
+                break
+        self.cuts_added += len(cuts)
+        self.max_pool_size = max(self.max_pool_size, len(self.name2mask))
+        return cuts
+
+    def names(self) -> list:
+        return list(self.name2mask)
+
+    def update_ages(self, names: list, slacks: list) -> list:
+        # returns names of the rows to be removed from the model
+        expired = []
+        for name, slack in zip(names, slacks):
+            if slack > self.abs_tol:
+                self.ages[name] += 1
+                if self.ages[name] >= self.max_age:
+                    expired.append(name)
+            else:
+                self.ages[name] = 0
+        for name in expired:
+            del self.name2mask[name]
+            del self.ages[name]
+        self.cuts_removed += len(expired)
+        return expired
+
+    def state(self) -> dict:
+        return dict(name2mask=dict(self.name2mask), ages=dict(self.ages), cut_counter=self.cut_counter,
+                    cuts_added=self.cuts_added, cuts_removed=self.cuts_removed,
+                    max_pool_size=self.max_pool_size)
+
+    def restore(self, state: dict) -> list:
+        # returns (name, var indexes) of the rows to be added back to the model
+        for key, value in state.items():
+            setattr(self, key, value)
+        return [(name, self.bit_graph.to_var_indexes(mask)) for name, mask in self.name2mask.items()]
+
+
+class PairPool(CutPool):
+    # lazy edge rows x_i + x_j <= 1 of non-adjacent vars, separated from solutions with both
+    # vars positive and aged out like the cuts; name2mask holds the (i, j) var index pair of a row
+
+    def __init__(self, adjacency: sp.csr_matrix, max_age: int = 10, max_cuts: int = 1000,
+                 abs_tol: float = 1e-4, block_size: int = 1024):
+        self.adjacency = adjacency.tocsr()
+        self.max_age = max_age
+        self.max_cuts = max_cuts
+        self.abs_tol = abs_tol
+        self.block_size = block_size
+        self.name2mask = dict()
+        self.ages = dict()
+        self.cut_counter = 0
+        self.cuts_added = 0
+        self.cuts_removed = 0
+        self.max_pool_size = 0
+
+    def separate(self, solution: np.ndarray) -> list:
+        # pairs of positive vars summing to more than one, scanned by blocks of rows, are looked
+        # up in the adjacency; the most violated max_cuts non-adjacent ones are returned as
+        # (name, [i, j]). Pairs with a row in the model are never violated
+        positive = np.flatnonzero(solution > self.abs_tol)
+        weights = solution[positive]
+        pairs = [np.empty((0, 2), dtype=np.int64)]
+        excesses = [np.empty(0)]
+        for start in range(0, len(positive), self.block_size):
+            excess = weights[start:start + self.block_size, None] + weights[None, :] - 1
+            rows, cols = np.nonzero(excess > self.abs_tol)
+            upper = cols > rows + start
+            pairs.append(np.stack([positive[rows[upper] + start], positive[cols[upper]]], axis=1))
+            excesses.append(excess[rows[upper], cols[upper]])
+        pairs, excesses = np.concatenate(pairs), np.concatenate(excesses)
+        if len(pairs) == 0:
+            return []
+        adjacent = np.asarray(self.adjacency[pairs[:, 0], pairs[:, 1]]).ravel().astype(np.bool_)
+        pairs, excesses = pairs[~adjacent], excesses[~adjacent]
+        most_violated = np.argsort(-excesses, kind='stable')[:self.max_cuts]
+        cuts = []
+        for pair in pairs[most_violated].tolist():
+            self.cut_counter += 1
+            name = f'pair{self.cut_counter}'
+            self.name2mask[name] = tuple(pair)
+            self.ages[name] = 0
+            cuts.append((name, pair))
+        self.cuts_added += len(cuts)
+        self.max_pool_size = max(self.max_pool_size, len(self.name2mask))
+        return cuts
+
+    def slacks(self, names: list, solution: np.ndarray) -> np.ndarray:
+        # 1 - x_i - x_j of the rows, without asking the solver
+        pairs = np.array([self.name2mask[name] for name in names], dtype=np.int64).reshape(-1, 2)
+        return 1 - solution[pairs[:, 0]] - solution[pairs[:, 1]]
+
+    def restore(self, state: dict) -> list:
+        for key, value in state.items():
+            setattr(self, key, value)
+        return [(name, list(pair)) for name, pair in self.name2mask.items()]
@@ -0,0 +1,181 @@
+import os
+import re
+import mmap
+import struct
+import hashlib
+
+import numpy as np
+import scipy.sparse as sp
+
+# cache layout: header, indptr (int64, n + 1), indices (int32, 2 * m)
+CACHE_SUFFIX = '.csr'
+CACHE_MAGIC = b'CLQCSR01'
+CACHE_HEADER = struct.Struct('<8sQQqQ20s')  # magic, n, m, source mtime_ns, source size, source sha1
+
+
+class CSRGraph:
+    # undirected graph as CSR arrays over var indexes, var index i is DIMACS node i + 1;
+    # arrays may be views into a memory-mapped cache file
+    def __init__(self, num_of_nodes: int, indptr: np.ndarray, indices: np.ndarray, buffer=None):
+        self.num_of_nodes = num_of_nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.buffer = buffer
+
+    def __getstate__(self):
+        # memory-mapped views are copied when the graph is sent to another process
+        return dict(num_of_nodes=self.num_of_nodes, indptr=np.array(self.indptr),
+                    indices=np.array(self.indices), buffer=None)
+
+    @classmethod
+    def from_edges(cls, num_of_nodes: int, edges: np.ndarray):
+        # edges: (m, 2) array of 0-based var indexes; self-loops and repeated edges (in either
+        # direction) are dropped
+        edges = np.sort(np.asarray(edges, dtype=np.int64).reshape(-1, 2), axis=1)
+        edges = np.unique(edges[edges[:, 0] != edges[:, 1]], axis=0)
+        rows = np.concatenate([edges[:, 0], edges[:, 1]])
+        cols = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(num_of_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_of_nodes), out=indptr[1:])
+        return cls(num_of_nodes, indptr, cols[order].astype(np.int32))
+
+    def number_of_nodes(self) -> int:
+        return self.num_of_nodes
+
+    def number_of_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def nodes(self) -> list:
+        return list(range(1, self.num_of_nodes + 1))
+
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    @property
+    def degree(self) -> list:
+        # (node, degree) pairs like nx.Graph.degree
+        return list(zip(self.nodes(), self.degrees().tolist()))
+
+    def neighbors(self, node: int) -> list:
+        return (self.indices[self.indptr[node - 1]:self.indptr[node]] + 1).tolist()
+
+    def edges(self) -> list:
+        rows = np.repeat(np.arange(self.num_of_nodes), self.degrees())
+        upper = self.indices > rows
+        return list(zip((rows[upper] + 1).tolist(), (self.indices[upper] + 1).tolist()))
+
+    def adjacency(self) -> sp.csr_matrix:
+        data = np.ones(len(self.indices), dtype=np.bool_)
+        return sp.csr_matrix((data, self.indices, self.indptr), shape=(self.num_of_nodes, self.num_of_nodes))
+
+
+HEADER_PATTERN = re.compile(rb'^p\s+\S+\s+(\d+)\s+(\d+)', re.M)
+EDGE_PATTERN = re.compile(rb'^e[ \t]+(\d+[ \t]+\d+)', re.M)
+
+
+def parse_edge_lines(data: bytes) -> np.ndarray:
+    # (m, 2) array of 0-based edges of the 'e u v' lines in data
+    edge_lines = b' '.join(EDGE_PATTERN.findall(data))
+    if not edge_lines:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.fromstring(edge_lines, dtype=np.int64, sep=' ').reshape(-1, 2) - 1
+
+
+def parse_dimacs(file_path: str) -> tuple:
+    # returns number of nodes, declared number of edges and (m, 2) array of 0-based edges
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    header = HEADER_PATTERN.search(data)
+    n_nodes, n_edges = int(header.group(1)), int(header.group(2))
+    return n_nodes, n_edges, parse_edge_lines(data)
+
+
+def read_header(file_path: str) -> tuple:
+    # number of nodes and declared number of edges, reading lines up to the 'p' line only
+    with open(file_path, 'rb') as file:
+        for line in file:
+            header = HEADER_PATTERN.match(line)
+            if header:
+                return int(header.group(1)), int(header.group(2))
+    raise ValueError(f'{file_path}: no problem line')
+
+
+def read_edge_chunks(file_path: str, chunk_size: int = 1 << 26):
+    # yields the edges of the file chunk by chunk (about chunk_size bytes of lines each),
+    # so that only one chunk of the edge list is in memory at a time
+    with open(file_path, 'rb') as file:
+        rest = b''
+        for block in iter(lambda: file.read(chunk_size), b''):
+            block = rest + block
+            end = block.rfind(b'\n') + 1
+            block, rest = block[:end], block[end:]
+            yield parse_edge_lines(block)
+        if rest:
+            yield parse_edge_lines(rest)
+
+
+def file_digest(file_path: str) -> bytes:
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def write_cache(cache_path: str, graph: CSRGraph, mtime_ns: int, size: int, digest: bytes):
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(CACHE_HEADER.pack(CACHE_MAGIC, graph.num_of_nodes, graph.number_of_edges(),
+                                     mtime_ns, size, digest))
+        file.write(graph.indptr.astype(np.int64).tobytes())
+        file.write(graph.indices.astype(np.int32).tobytes())
+    os.replace(tmp_path, cache_path)
+
+
+def read_cache(cache_path: str, file_path: str):
+    # memory-map the cache if it matches the source file (same mtime, or same content hash)
+    if not os.path.exists(cache_path):
+        return None
+    stat = os.stat(file_path)
+    with open(cache_path, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, n_nodes, n_edges, mtime_ns, size, digest = CACHE_HEADER.unpack_from(buffer)
+    if magic != CACHE_MAGIC or size != stat.st_size:
+        return None
+    if mtime_ns != stat.st_mtime_ns and digest != file_digest(file_path):
+        return None
+    offset = CACHE_HEADER.size
+    indptr = np.frombuffer(buffer, dtype=np.int64, count=n_nodes + 1, offset=offset)
+    offset += indptr.nbytes
+    indices = np.frombuffer(buffer, dtype=np.int32, count=2 * n_edges, offset=offset)
+    return CSRGraph(n_nodes, indptr, indices, buffer=buffer)
+
+
+def load_dimacs(file_path: str, use_cache: bool = True, verbose: bool = False) -> CSRGraph:
+    cache_path = file_path + CACHE_SUFFIX
+    if use_cache:
+        graph = read_cache(cache_path, file_path)
+        if graph is not None:
+            return graph
+    n_nodes, n_edges, edges = parse_dimacs(file_path)
+    if verbose:
+        print(f'Nodes:  {n_nodes} Edges: {n_edges}')
+    graph = CSRGraph.from_edges(n_nodes, edges)
+    if use_cache:
+        stat = os.stat(file_path)
+        try:
+            write_cache(cache_path, graph, stat.st_mtime_ns, stat.st_size, file_digest(file_path))
+        except OSError as error:
+            print(f'Could not write graph cache: {error}')
+    return graph
+
+
+def write_dimacs(file_path: str, graph: CSRGraph, comment: str = None):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        if comment:
+            file.write(f'c {comment}\n')
+        file.write(f'p edge {graph.number_of_nodes()} {graph.number_of_edges()}\n')
+        file.writelines(f'e {node_i} {node_j}\n' for node_i, node_j in graph.edges())
+    os.replace(tmp_path, file_path)
@@ -1,71 +1,145 @@
+import time
 import numpy as np
 import networkx as nx
+
+import utils
 from utils import read_graph_file
 from benchmarks import EASY, MEDIUM, HARD
-from problem import ProblemHandler
 
 
 class HeuristicMaxClique:
 
-    def __init__(self, graph: nx.Graph):
+    def __init__(self, graph: nx.Graph, time_budget: float = 1.0, n_batches: int = 4,
+                 batch_size: int = 64, max_stall_iterations: int = None, seed: int = None):
+        # graph is nx.Graph or dimacs.CSRGraph, var index i stands for node i + 1
         self.graph = graph
-        self.strategies = [
-            self.largest_first_randomized,
-            self.color_first_randomized
-        ]
-        self.coloring_strategies = ProblemHandler.STRATEGIES
+        self.adjacency = utils.adjacency_matrix(graph).toarray()
+        self.non_adjacency = ~self.adjacency
+        np.fill_diagonal(self.non_adjacency, False)
+        self.degrees = self.adjacency.sum(axis=1)
+        self.num_of_nodes = len(self.degrees)
+        # wall-clock budget of the local search, which also stops after max_stall_iterations
+        # iterations without improvement
+        self.time_budget = time_budget
+        self.n_batches = n_batches
+        self.batch_size = batch_size
+        self.max_stall_iterations = max_stall_iterations or 20 * self.num_of_nodes
+        self.rng = np.random.default_rng(seed)
 
     def run(self):
-        best_clique_size = 0
-        best_clique = None
-        for strategy in self.strategies:
-            for coloring_strategy in self.coloring_strategies:
-                found_clique = strategy(self.graph, strategy=coloring_strategy)
-                if best_clique_size < len(found_clique):
-                    best_clique_size = len(found_clique)
-                    best_clique = found_clique
+        best_clique = np.zeros(self.num_of_nodes, dtype=np.bool_)
+        for batch in range(self.n_batches):
+            # even batches follow the degree inside the remaining candidates, odd ones a noisy static degree
+            cliques = self.greedy_batch(self.batch_size, dynamic=batch % 2 == 0)
+            sizes = cliques.sum(axis=1)
+            if sizes.max() > best_clique.sum():
+                best_clique = cliques[sizes.argmax()]
+        best_clique = self.local_search(best_clique)
         # return result in a form [0, 1, 0..., 0]
-        return [1.0 if i + 1 in best_clique else 0.0
-                for i in range(self.graph.number_of_nodes())]
-
-    @staticmethod
-    def color_first_randomized(graph: nx.Graph, n_iterations: int = 15,
-                               strategy=nx.coloring.strategy_random_sequential) -> set:
-        best_clique = set()
-        best_clique_size = 0
-        for _ in range(n_iterations):
-            coloring_dct = nx.coloring.greedy_color(graph, strategy=strategy)
-            sorted_coloring = sorted(coloring_dct.items(), key=lambda item: item[1], reverse=True)
-            nodes = [node for node, color in sorted_coloring]
-            clique = set()
-            first_index = 0
-            while len(nodes) > 0:
-                neighbors = list(graph.neighbors(nodes[first_index]))
-                clique.add(nodes[first_index])
-                nodes = list(filter(lambda x: x in neighbors, nodes))
-            if len(clique) > best_clique_size:
-                best_clique = clique
-                best_clique_size = len(clique)
-        return best_clique
+        return best_clique.astype(float).tolist()
 
-    @staticmethod
-    def largest_first_randomized(graph: nx.Graph, n_iterations: int = 50,
-                                 k_first: int = 5, **kwargs) -> set:
-        best_clique = None
-        best_clique_size = 0
-        for _ in range(n_iterations):
-            clique = set()
-            nodes = [node[0] for node in sorted(nx.degree(graph), key=lambda x: x[1], reverse=True)]
-            while len(nodes) > 0:
-                random_index = np.random.randint(0, min(k_first, len(nodes)))
-                neighbors = list(graph.neighbors(nodes[random_index]))
-                clique.add(nodes[random_index])
-                nodes = list(filter(lambda x: x in neighbors, nodes))
-            if len(clique) > best_clique_size:
-                best_clique = clique
-                best_clique_size = len(clique)
+    def greedy_batch(self, batch_size: int, dynamic: bool = True, noise: float = 0.5) -> np.ndarray:
+        # batch_size randomized greedy restarts at once as rows of boolean masks: every row
+        # adds its best scored candidate and keeps only the candidates adjacent to it
+        rows = np.arange(batch_size)
+        candidates = np.ones((batch_size, self.num_of_nodes), dtype=np.bool_)
+        cliques = np.zeros((batch_size, self.num_of_nodes), dtype=np.bool_)
+        adjacency = self.adjacency.astype(np.float32) if dynamic else None
+        while candidates.any():
+            if dynamic:
+                scores = candidates.astype(np.float32) @ adjacency
+            else:
+                scores = np.broadcast_to(self.degrees.astype(np.float32), candidates.shape)
+            scores = scores * (1 + noise * self.rng.random(candidates.shape, dtype=np.float32))
+            scores[~candidates] = -1
+            selected = scores.argmax(axis=1)
+            active = candidates.any(axis=1)
+            cliques[rows[active], selected[active]] = True
+            candidates[active] &= self.adjacency[selected[active]]
+        return cliques
+
+    def local_search(self, clique: np.ndarray) -> np.ndarray:
+        # iterated local search on the clique: add free vertices and apply (1, 2)-swaps until
+        # a local optimum, then perturb by forcing a random vertex in (ARW-style)
+        deadline = time.perf_counter() + self.time_budget
+        clique = clique.copy()
+        # number of clique members not adjacent to every vertex
+        missing = self.non_adjacency[clique].sum(axis=0)
+        best_clique = clique.copy()
+        age = np.zeros(self.num_of_nodes, dtype=np.int64)
+        stall_iterations = 0
+        iteration = 0
+        while stall_iterations < self.max_stall_iterations and time.perf_counter() < deadline:
+            iteration += 1
+            current_size = clique.sum()
+            self.improve(clique, missing, age, iteration)
+            if clique.sum() > best_clique.sum():
+                best_clique = clique.copy()
+                stall_iterations = 0
+            else:
+                stall_iterations += 1
+            new_size = clique.sum()
+            if new_size < current_size:
+                # worse local optima are accepted with probability 1 / (1 + delta * delta_best)
+                delta, delta_best = current_size - new_size, best_clique.sum() - new_size
+                if self.rng.random() > 1 / (1 + delta * delta_best):
+                    clique[:] = best_clique
+                    missing[:] = self.non_adjacency[clique].sum(axis=0)
+            self.perturb(clique, missing, age, iteration)
         return best_clique
 
+    def improve(self, clique: np.ndarray, missing: np.ndarray, age: np.ndarray, iteration: int):
+        while True:
+            free = np.flatnonzero(~clique & (missing == 0))
+            if len(free) > 0:
+                self.add(self.rng.choice(free), clique, missing, age, iteration)
+                continue
+            if not self.two_improvement(clique, missing, age, iteration):
+                return
+
+    def two_improvement(self, clique: np.ndarray, missing: np.ndarray, age: np.ndarray, iteration: int) -> bool:
+        # (1, 2)-swap: drop x and add two adjacent vertices whose only non-neighbor in the clique is x
+        one_tight = np.flatnonzero(~clique & (missing == 1))
+        if len(one_tight) < 2:
+            return False
+        clique_nodes = np.flatnonzero(clique)
+        mates = clique_nodes[self.non_adjacency[np.ix_(one_tight, clique_nodes)].argmax(axis=1)]
+        for mate in self.rng.permutation(np.unique(mates)):
+            tight = one_tight[mates == mate]
+            if len(tight) < 2:
+                continue
+            pairs = np.argwhere(np.triu(self.adjacency[np.ix_(tight, tight)], k=1))
+            if len(pairs) == 0:
+                continue
+            node_i, node_j = tight[pairs[self.rng.integers(len(pairs))]]
+            self.remove(mate, clique, missing, age, iteration)
+            self.add(node_i, clique, missing, age, iteration)
+            self.add(node_j, clique, missing, age, iteration)
+            return True
+        return False
+
+    def perturb(self, clique: np.ndarray, missing: np.ndarray, age: np.ndarray, iteration: int):
+        # force in one of a few random outside vertices, the least recently moved one,
+        # and drop its non-neighbors
+        outside = np.flatnonzero(~clique)
+        if len(outside) == 0:
+            return
+        sample = self.rng.choice(outside, size=min(4, len(outside)), replace=False)
+        node = sample[age[sample].argmin()]
+        for other in np.flatnonzero(clique & self.non_adjacency[node]):
+            self.remove(other, clique, missing, age, iteration)
+        self.add(node, clique, missing, age, iteration)
+
+    def add(self, node: int, clique: np.ndarray, missing: np.ndarray, age: np.ndarray, iteration: int):
+        clique[node] = True
+        missing += self.non_adjacency[node]
+        age[node] = iteration
+
+    def remove(self, node: int, clique: np.ndarray, missing: np.ndarray, age: np.ndarray, iteration: int):
+        clique[node] = False
+        missing -= self.non_adjacency[node]
+        age[node] = iteration
+
 
 def test_max_clique_heuristic():
     benches = {**EASY,
@@ -0,0 +1,403 @@
+import os
+import sys
+import mmap
+import time
+import struct
+import resource
+import contextlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import utils
+from dimacs import CSRGraph, read_header, read_edge_chunks
+from backend import make_backend
+from heuristic import HeuristicMaxClique
+from reduction import GraphReducer
+from branch_and_bound import BranchAndBound
+
+# vertices relabeled in non-decreasing degree order; layout: header, indptr (int64, n + 1),
+# indices (int32, 2 * m), labels (int64, n: original var index of every vertex)
+ORDERED_SUFFIX = '.dcsr'
+ORDERED_MAGIC = b'CLQDEG01'
+ORDERED_HEADER = struct.Struct('<8sQQqQ')  # magic, n, m, source mtime_ns, source size
+# position in the degeneracy order and core number of every vertex, int64 array of shape (2, n)
+DEGENERACY_SUFFIX = '.core.npy'
+CHUNK_SIZE = 1 << 26
+
+
+def write_ordered_csr(file_path: str, csr_path: str, chunk_size: int = CHUNK_SIZE):
+    # two passes over the edge list, chunk_size bytes at a time: degrees, then every edge is
+    # scattered into its rows of the memory-mapped file. Rows are sorted and deduplicated block
+    # by block afterwards, so memory stays O(n) plus a chunk whatever the number of edges
+    n_nodes, _ = read_header(file_path)
+    degrees = np.zeros(n_nodes, dtype=np.int64)
+    for edges in read_edge_chunks(file_path, chunk_size):
+        edges = edges[edges[:, 0] != edges[:, 1]]
+        if len(edges) and (edges.min() < 0 or edges.max() >= n_nodes):
+            raise ValueError(f'{file_path}: edge nodes must be in 1..{n_nodes}')
+        degrees += np.bincount(edges.ravel(), minlength=n_nodes)
+    labels = np.argsort(degrees, kind='stable')
+    new_labels = np.empty(n_nodes, dtype=np.int64)
+    new_labels[labels] = np.arange(n_nodes)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(degrees[labels], out=indptr[1:])
+    indices_offset = ORDERED_HEADER.size + indptr.nbytes
+    tmp_path = csr_path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.truncate(indices_offset + 4 * int(indptr[-1]) + labels.nbytes)
+    indices = np.memmap(tmp_path, dtype=np.int32, mode='r+', offset=indices_offset, shape=(int(indptr[-1]),))
+    fill = indptr[:-1].copy()
+    for edges in read_edge_chunks(file_path, chunk_size):
+        edges = new_labels[edges[edges[:, 0] != edges[:, 1]]]
+        if len(edges) == 0:
+            continue
+        rows = np.concatenate([edges[:, 0], edges[:, 1]])
+        cols = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.argsort(rows, kind='stable')
+        rows, cols = rows[order], cols[order]
+        # the k-th entry of a row in this chunk goes k places after the fill pointer of the row
+        starts = np.flatnonzero(np.concatenate([[True], rows[1:] != rows[:-1]]))
+        counts = np.diff(np.append(starts, len(rows)))
+        indices[fill[rows] + np.arange(len(rows)) - np.repeat(starts, counts)] = cols
+        fill[rows[starts]] += counts
+    # sort rows and drop repeated edges, compacting the entries towards the front of the file
+    compact_indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    block_entries = max(chunk_size // 16, 1)
+    written = 0
+    row = 0
+    while row < n_nodes:
+        end = int(np.searchsorted(indptr, indptr[row] + block_entries, side='right')) - 1
+        end = min(max(end, row + 1), n_nodes)
+        block = np.array(indices[indptr[row]:indptr[end]])
+        block_rows = np.repeat(np.arange(row, end), np.diff(indptr[row:end + 1]))
+        order = np.lexsort((block, block_rows))
+        block, block_rows = block[order], block_rows[order]
+        keep = np.ones(len(block), dtype=np.bool_)
+        keep[1:] = (block[1:] != block[:-1]) | (block_rows[1:] != block_rows[:-1])
+        indices[written:written + keep.sum()] = block[keep]
+        compact_indptr[row + 1:end + 1] = written + np.cumsum(np.bincount(block_rows[keep] - row,
+                                                                         minlength=end - row))
+        written += int(keep.sum())
+        row = end
+    indices.flush()
+    del indices
+    stat = os.stat(file_path)
+    with open(tmp_path, 'r+b') as file:
+        file.write(ORDERED_HEADER.pack(ORDERED_MAGIC, n_nodes, written // 2, stat.st_mtime_ns, stat.st_size))
+        file.write(compact_indptr.tobytes())
+        file.seek(indices_offset + 4 * written)
+        file.write(labels.tobytes())
+        file.truncate()
+    os.replace(tmp_path, csr_path)
+
+
+def read_ordered_csr(csr_path: str, file_path: str = None):
+    # (CSRGraph on a memory map of the file, labels); None if there is no file or it is older
+    # than the source file_path
+    if not os.path.exists(csr_path):
+        return None
+    with open(csr_path, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, n_nodes, n_edges, mtime_ns, size = ORDERED_HEADER.unpack_from(buffer)
+    if magic != ORDERED_MAGIC:
+        return None
+    if file_path is not None:
+        stat = os.stat(file_path)
+        if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+            return None
+    offset = ORDERED_HEADER.size
+    indptr = np.frombuffer(buffer, dtype=np.int64, count=n_nodes + 1, offset=offset)
+    offset += indptr.nbytes
+    indices = np.frombuffer(buffer, dtype=np.int32, count=2 * n_edges, offset=offset)
+    offset += indices.nbytes
+    labels = np.frombuffer(buffer, dtype=np.int64, count=n_nodes, offset=offset)
+    return CSRGraph(n_nodes, indptr, indices, buffer=buffer), labels
+
+
+def load_ordered_csr(file_path: str, csr_path: str = None, chunk_size: int = CHUNK_SIZE) -> tuple:
+    # the degree ordered CSR of a DIMACS file, written next to it (<file>.dcsr) on first use
+    csr_path = csr_path or file_path + ORDERED_SUFFIX
+    loaded = read_ordered_csr(csr_path, file_path)
+    if loaded is None:
+        write_ordered_csr(file_path, csr_path, chunk_size=chunk_size)
+        loaded = read_ordered_csr(csr_path)
+    return loaded
+
+
+def gather_rows(graph: CSRGraph, rows: np.ndarray) -> tuple:
+    # concatenated adjacency rows of rows and the row of every entry
+    starts = graph.indptr[rows]
+    lengths = graph.indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return graph.indices[offsets], np.repeat(rows, lengths)
+
+
+def degeneracy_order(graph: CSRGraph) -> tuple:
+    # (position, core) of every vertex. All vertices of remaining degree <= k are peeled at once,
+    # k rises to the smallest remaining degree when none is left: a vertex has at most k
+    # neighbors peeled with or after it, so at most core many neighbors later in the order
+    n = graph.number_of_nodes()
+    degrees = graph.degrees().astype(np.int64)
+    alive = np.ones(n, dtype=np.bool_)
+    core = np.zeros(n, dtype=np.int64)
+    order = np.empty(n, dtype=np.int64)
+    count = 0
+    k = 0
+    while count < n:
+        k = max(k, int(degrees[alive].min()))
+        batch = np.flatnonzero(alive & (degrees <= k))
+        while len(batch):
+            alive[batch] = False
+            core[batch] = k
+            order[count:count + len(batch)] = batch
+            count += len(batch)
+            neighbors, _ = gather_rows(graph, batch)
+            neighbors, counts = np.unique(neighbors[alive[neighbors]], return_counts=True)
+            degrees[neighbors] -= counts
+            # only the neighbors of peeled vertices can drop to k
+            batch = neighbors[degrees[neighbors] <= k]
+    position = np.empty(n, dtype=np.int64)
+    position[order] = np.arange(n)
+    return position, core
+
+
+def load_degeneracy(csr_path: str, graph: CSRGraph) -> tuple:
+    # degeneracy_order of the ordered CSR, cached in <csr_path>.core.npy
+    path = csr_path + DEGENERACY_SUFFIX
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(csr_path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, np.stack(degeneracy_order(graph)))
+        os.replace(tmp_path, path)
+    position, core = np.load(path, mmap_mode='r')
+    return position, core
+
+
+class SubproblemSolver:
+    # solves the per-vertex subproblems of one process: the largest clique of v and its later
+    # neighbors in degeneracy order (at most core(v) vertices), which must beat the lower bound
+    # shared by all processes
+
+    def __init__(self, csr_path: str, lower_bound, backend: str = 'cplex', exact: bool = True,
+                 heuristic_time: float = 0.002, deadline: float = None, quiet: bool = True):
+        self.csr_path = csr_path
+        self.graph, self.labels = read_ordered_csr(csr_path)
+        self.position, self.core = load_degeneracy(csr_path, self.graph)
+        # multiprocessing.Value with the size of the largest clique found by any process
+        self.lower_bound = lower_bound
+        self.backend = backend
+        # False stops at the local search of every subproblem
+        self.exact = exact
+        self.heuristic_time = heuristic_time
+        self.deadline = deadline
+        self.quiet = quiet
+
+    def later_neighbors(self, vertex: int, lower_bound: int) -> np.ndarray:
+        # members of a clique larger than lower_bound have core >= lower_bound
+        row = np.asarray(self.graph.indices[self.graph.indptr[vertex]:self.graph.indptr[vertex + 1]],
+                         dtype=np.int64)
+        return row[(self.position[row] > self.position[vertex]) & (self.core[row] >= lower_bound)]
+
+    def induced_subgraph(self, vertices: np.ndarray) -> CSRGraph:
+        # vertices are sorted, node i of the subgraph is vertices[i - 1]
+        cols, rows = gather_rows(self.graph, vertices)
+        targets = np.minimum(np.searchsorted(vertices, cols), len(vertices) - 1)
+        sources = np.searchsorted(vertices, rows)
+        inside = (vertices[targets] == cols) & (sources < targets)
+        return CSRGraph.from_edges(len(vertices), np.stack([sources[inside], targets[inside]], axis=1))
+
+    def solve_subproblem(self, subgraph: CSRGraph, lower_bound: int) -> tuple:
+        # (nodes of a clique of subgraph larger than lower_bound or None, upper bound of the
+        # subproblem if it is not solved or None, B&B nodes)
+        heuristic_clique = HeuristicMaxClique(subgraph, time_budget=self.heuristic_time, seed=0).run()
+        heuristic_clique_size = int(sum(heuristic_clique))
+        clique = utils.to_node_indexes(heuristic_clique) if heuristic_clique_size > lower_bound else None
+        lower_bound = max(lower_bound, heuristic_clique_size)
+        if not self.exact:
+            return clique, subgraph.number_of_nodes(), 0
+        reducer = GraphReducer(subgraph, lower_bound=lower_bound)
+        reduced_graph = reducer.run()
+        if reduced_graph.number_of_nodes() <= lower_bound:
+            return clique, None, 0
+        problem = make_backend(self.backend, reduced_graph, threads=1)
+        problem.design_problem()
+        time_limit = max(self.deadline - time.time(), 1e-3) if self.deadline is not None else None
+        bnb = BranchAndBound(problem=problem, initial_obj_value=lower_bound, initial_solution=None,
+                             time_limit=time_limit)
+        bnb.timed_run()
+        if bnb.best_obj_value > lower_bound:
+            clique = reducer.to_original_nodes(utils.to_node_indexes(bnb.best_solution))
+        return clique, bnb.upper_bound if bnb.timed_out or bnb.unsolved_nodes else None, bnb.call_counter
+
+    def solve_batch(self, vertices: list) -> dict:
+        # best clique (original nodes) through the vertices larger than the shared lower bound;
+        # open_bound bounds the cliques of the subproblems left unsolved
+        result = dict(size=0, clique=None, solved=0, skipped=0, bnb_nodes=0, open_bound=0)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if self.quiet else sys.stdout):
+            for vertex in vertices:
+                lower_bound = self.lower_bound.value
+                if self.core[vertex] + 1 <= lower_bound:
+                    result['skipped'] += 1
+                    continue
+                if self.deadline is not None and time.time() > self.deadline:
+                    result['open_bound'] = max(result['open_bound'], int(self.core[vertex]) + 1)
+                    continue
+                candidates = self.later_neighbors(vertex, lower_bound)
+                if len(candidates) + 1 <= lower_bound:
+                    result['skipped'] += 1
+                    continue
+                clique, open_bound = [], None
+                if len(candidates):
+                    clique, open_bound, bnb_nodes = self.solve_subproblem(self.induced_subgraph(candidates),
+                                                                          max(lower_bound - 1, 0))
+                    result['bnb_nodes'] += bnb_nodes
+                result['solved'] += 1
+                if open_bound is not None:
+                    result['open_bound'] = max(result['open_bound'], open_bound + 1)
+                if clique is None:
+                    continue
+                members = np.append(candidates[np.asarray(clique, dtype=np.int64) - 1], vertex)
+                with self.lower_bound.get_lock():
+                    self.lower_bound.value = max(self.lower_bound.value, len(members))
+                if len(members) > result['size']:
+                    result.update(size=len(members), clique=sorted((self.labels[members] + 1).tolist()))
+        return result
+
+
+subproblem_solver = None
+
+
+def init_worker(*args):
+    global subproblem_solver
+    subproblem_solver = SubproblemSolver(*args)
+
+
+def solve_batch(vertices: list) -> dict:
+    return subproblem_solver.solve_batch(vertices)
+
+
+class LargeGraphSolver:
+    # maximum clique of a large sparse graph: the edge list is streamed into a degree ordered
+    # CSR file, and the per-vertex subproblems of a degeneracy ordering are solved by n_workers
+    # processes, highest core number first. Workers memory-map the graph and hold one
+    # subproblem (at most degeneracy + 1 vertices) at a time
+
+    def __init__(self, file_path: str, n_workers: int = None, backend: str = 'cplex', exact: bool = True,
+                 time_limit: float = None, heuristic_time: float = 0.002, batch_size: int = 64,
+                 chunk_size: int = CHUNK_SIZE, csr_path: str = None, verbose: bool = False):
+        self.file_path = file_path
+        self.csr_path = csr_path or file_path + ORDERED_SUFFIX
+        self.n_workers = n_workers or os.cpu_count()
+        self.backend = backend
+        self.exact = exact
+        self.time_limit = time_limit
+        self.heuristic_time = heuristic_time
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+        self.best_clique = []
+        self.upper_bound = None
+        self.subproblems_solved = 0
+        self.subproblems_skipped = 0
+        self.bnb_nodes = 0
+
+    def run(self) -> dict:
+        tic = time.perf_counter()
+        graph, labels = load_ordered_csr(self.file_path, self.csr_path, chunk_size=self.chunk_size)
+        stream_time = time.perf_counter() - tic
+        print(f'Nodes: {graph.number_of_nodes()} Edges: {graph.number_of_edges()}')
+        tic = time.perf_counter()
+        position, core = load_degeneracy(self.csr_path, graph)
+        degeneracy = int(core.max()) if len(core) else 0
+        degeneracy_time = time.perf_counter() - tic
+        print(f'Degeneracy: {degeneracy}')
+        tic = time.perf_counter()
+        deadline = time.time() + self.time_limit if self.time_limit else None
+        lower_bound = mp.Value('i', 0)
+        # highest core first, the vertices of a core by their position in the degeneracy order
+        order = np.lexsort((position, -np.asarray(core)))
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+        open_bound = 0
+        solver_args = (self.csr_path, lower_bound, self.backend, self.exact, self.heuristic_time, deadline,
+                       not self.verbose)
+        if self.n_workers == 1:
+            init_worker(*solver_args)
+            for batch_index, batch in enumerate(batches):
+                if core[batch[0]] + 1 <= lower_bound.value:
+                    break
+                if deadline is not None and time.time() > deadline:
+                    open_bound = int(core[batch[0]]) + 1
+                    break
+                self.collect(solve_batch(batch))
+        else:
+            with ProcessPoolExecutor(max_workers=self.n_workers, initializer=init_worker,
+                                     initargs=solver_args) as executor:
+                # a few batches per worker in flight, later batches are checked against the bound first
+                running = set()
+                next_batch = 0
+                while next_batch < len(batches) or running:
+                    while next_batch < len(batches) and len(running) < 2 * self.n_workers:
+                        first = batches[next_batch][0]
+                        if core[first] + 1 <= lower_bound.value:
+                            next_batch = len(batches)
+                        elif deadline is not None and time.time() > deadline:
+                            open_bound = int(core[first]) + 1
+                            next_batch = len(batches)
+                        else:
+                            running.add(executor.submit(solve_batch, batches[next_batch]))
+                            next_batch += 1
+                    if running:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.collect(future.result())
+        search_time = time.perf_counter() - tic
+        self.upper_bound = max(len(self.best_clique), open_bound, self.upper_bound or 0)
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        return dict(benchmark=os.path.basename(self.file_path),
+                    num_nodes=graph.number_of_nodes(),
+                    num_edges=graph.number_of_edges(),
+                    degeneracy=degeneracy,
+                    clique_size=len(self.best_clique),
+                    clique=self.best_clique,
+                    is_clique=self.is_clique(graph, labels, self.best_clique),
+                    optimal=self.upper_bound <= len(self.best_clique),
+                    upper_bound=self.upper_bound,
+                    subproblems_solved=self.subproblems_solved,
+                    subproblems_skipped=self.subproblems_skipped,
+                    bnb_call_count=self.bnb_nodes,
+                    stream_time_seconds=stream_time,
+                    degeneracy_time_seconds=degeneracy_time,
+                    search_time_seconds=search_time,
+                    peak_memory_mb=usage,
+                    worker_peak_memory_mb=children_usage if self.n_workers > 1 else None)
+
+    def collect(self, result: dict):
+        self.subproblems_solved += result['solved']
+        self.subproblems_skipped += result['skipped']
+        self.bnb_nodes += result['bnb_nodes']
+        self.upper_bound = max(self.upper_bound or 0, result['open_bound'])
+        if result['size'] > len(self.best_clique):
+            self.best_clique = result['clique']
+            print(f'Clique of size {result["size"]} found')
+
+    @staticmethod
+    def is_clique(graph: CSRGraph, labels: np.ndarray, nodes: list) -> bool:
+        # nodes of the original graph, checked on the rows of the ordered CSR
+        new_labels = np.flatnonzero(np.isin(labels, np.asarray(nodes, dtype=np.int64) - 1))
+        for vertex in new_labels:
+            row = graph.indices[graph.indptr[vertex]:graph.indptr[vertex + 1]]
+            if not np.isin(new_labels[new_labels != vertex], row).all():
+                return False
+        return len(new_labels) == len(nodes)
+
+
+if __name__ == '__main__':
+    from pprint import pprint
+    args = utils.large_graph_arg_parser()
+    solver = LargeGraphSolver(args.filepath, n_workers=args.workers, backend=args.backend,
+                              exact=not args.heuristic_only, time_limit=args.time_limit,
+                              batch_size=args.batch_size, chunk_size=args.chunk_mb << 20, verbose=args.verbose)
+    pprint(solver.run())
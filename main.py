@@ -1,3 +1,4 @@
+import sys
 import utils
 from pprint import pprint
 from run_test import run_test
@@ -5,5 +6,18 @@ from run_test import run_test
 if __name__ == '__main__':
     args = utils.main_arg_parser()
     filepath = args.filepath
-    result = run_test(filepath)
+    checkpoint_path = args.checkpoint or (filepath + '.ckpt' if args.resume else None)
+    progress_stream = None
+    if args.progress_file:
+        progress_stream = sys.stdout if args.progress_file == '-' else open(args.progress_file, 'a')
+    result = run_test(filepath, node_selection=args.node_selection, time_limit=args.time_limit,
+                      max_open_nodes=args.max_open_nodes, separate_cuts=args.separate_cuts,
+                      parallel_workers=args.workers, backend=args.backend,
+                      progress_callback=utils.progress_printer(progress_stream) if progress_stream else None,
+                      progress_interval=args.progress_interval, checkpoint_path=checkpoint_path,
+                      checkpoint_interval=args.checkpoint_interval, resume=args.resume,
+                      profile=args.profile, profile_output=args.profile_output,
+                      branching_rule=args.branching_rule, symmetry=args.symmetry,
+                      symmetry_time_limit=args.symmetry_time_limit,
+                      lazy_pairs=args.lazy_pairs)
     pprint(result)
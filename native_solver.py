@@ -0,0 +1,194 @@
+import time
+import tracemalloc
+
+import networkx as nx
+
+import utils
+from bitset import BitGraph
+from backend import SolverBackend
+
+
+class NativeBackend(SolverBackend):
+    # exact max clique search on bitsets (MCS/BBMC-style coloring bound plus a MaxSAT failed-literal
+    # test); solving a node searches its whole subtree, so the returned value is the node optimum
+    name = 'native'
+
+    def __init__(self, graph: nx.Graph, check_period: int = 1000):
+        super().__init__(graph)
+        self.bit_graph = None
+        self.fixed_ones = 0
+        self.fixed_zeros = 0
+        self.solution_mask = 0
+        # the clock is read every check_period search nodes
+        self.check_period = check_period
+        self.deadline = None
+        self.progress_hook = None
+        # search nodes of the last solve and over all solves
+        self.num_iterations = 0
+        self.total_iterations = 0
+        self.coloring_pruned = 0
+        self.maxsat_pruned = 0
+        # best clique size and clique within the candidates of the current solve
+        self.local_best = None
+        self.local_mask = 0
+
+    def design_problem(self, trace_memory: bool = False):
+        tic = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start()
+        self.bit_graph = BitGraph(self.graph)
+        if trace_memory:
+            self.build_peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        self.build_time = time.perf_counter() - tic
+        return
+
+    def fix_variables(self, var_indexes: list, value: float):
+        mask = self.bit_graph.to_mask(var_indexes)
+        self.fixed_ones &= ~mask
+        self.fixed_zeros &= ~mask
+        if value > 0.5:
+            self.fixed_ones |= mask
+        else:
+            self.fixed_zeros |= mask
+        return
+
+    def restore_bounds(self, var_indexes: list):
+        mask = self.bit_graph.to_mask(var_indexes)
+        self.fixed_ones &= ~mask
+        self.fixed_zeros &= ~mask
+        return
+
+    def solve_problem(self, lower_bound: float = None) -> float:
+        # largest clique containing the vars fixed to one and none of the vars fixed to zero;
+        # returns lower_bound if there is no clique larger than it
+        if self.bit_graph:
+            self.num_iterations = 0
+            self.solution_mask = 0
+            if not self.bit_graph.is_clique(self.fixed_ones):
+                return 0.0
+            fixed_size = bin(self.fixed_ones).count('1')
+            candidates = self.bit_graph.common_neighbors(self.fixed_ones) & ~self.fixed_zeros
+            self.local_best = -1 if lower_bound is None else int(lower_bound) - fixed_size
+            self.local_mask = None
+            self.expand(0, 0, candidates, fixed_size)
+            self.total_iterations += self.num_iterations
+            if self.local_mask is None:
+                return float(lower_bound)
+            self.solution_mask = self.fixed_ones | self.local_mask
+            return float(fixed_size + self.local_best)
+        else:
+            raise RuntimeError("Problem is not constructed yet")
+
+    def get_solution(self) -> list:
+        if self.bit_graph:
+            solution = [0.0] * self.bit_graph.num_of_nodes
+            for var_index in self.bit_graph.to_var_indexes(self.solution_mask):
+                solution[var_index] = 1.0
+            return solution
+        else:
+            raise RuntimeError("Problem is not constructed yet")
+
+    def get_num_iterations(self) -> int:
+        return self.num_iterations
+
+    def set_time_limit(self, seconds: float):
+        self.deadline = None if seconds is None else time.perf_counter() + seconds
+        return
+
+    def set_progress_hook(self, hook):
+        self.progress_hook = hook
+        return
+
+    def expand(self, clique: int, size: int, candidates: int, fixed_size: int):
+        self.num_iterations += 1
+        if size > self.local_best:
+            self.local_best, self.local_mask = size, clique
+        if self.num_iterations % self.check_period == 0 and (self.deadline or self.progress_hook):
+            if self.progress_hook is not None:
+                self.report_progress(fixed_size)
+            if self.deadline and time.perf_counter() > self.deadline:
+                self.timeout(fixed_size)
+        adjacency = self.bit_graph.adjacency
+        color_classes, branching = self.color_sort(candidates, self.local_best - size)
+        # highest colors first: the color of a vertex bounds the cliques among it and the vertices before it
+        for bit, color in reversed(branching):
+            k_min = self.local_best - size
+            if color <= k_min:
+                self.coloring_pruned += 1
+                return
+            neighbors = candidates & adjacency[bit]
+            if color == k_min + 1 and self.is_failed_literal(neighbors, color_classes[:k_min]):
+                self.maxsat_pruned += 1
+            else:
+                self.expand(clique | 1 << bit, size + 1, neighbors, fixed_size)
+            candidates &= ~(1 << bit)
+        return
+
+    def report_progress(self, fixed_size: int):
+        # the whole subtree is one solve, the progress hook gets its best clique so far
+        solution = None
+        if self.local_mask is not None:
+            self.solution_mask = self.fixed_ones | self.local_mask
+            solution = self.get_solution()
+        self.progress_hook(fixed_size + self.local_best, solution)
+        return
+
+    def timeout(self, fixed_size: int):
+        # hand the best clique of the interrupted solve over with the exception
+        best_solution = None
+        if self.local_mask is not None:
+            self.solution_mask = self.fixed_ones | self.local_mask
+            best_solution = self.get_solution()
+        self.total_iterations += self.num_iterations
+        raise utils.TimeoutException(best_clique_size=fixed_size + self.local_best, best_solution=best_solution,
+                                     msg='TIMEOUT: native search time limit reached')
+
+    def color_sort(self, candidates: int, k_min: int) -> tuple:
+        # greedy color classes of candidates and the (bit, color) pairs colored above k_min,
+        # vertices colored k_min or lower cannot lead to a better clique and are not branched on
+        adjacency = self.bit_graph.adjacency
+        color_classes = []
+        branching = []
+        uncolored = candidates
+        while uncolored:
+            color_class = 0
+            available = uncolored
+            while available:
+                low = available & -available
+                color_class |= low
+                available &= ~(adjacency[low.bit_length() - 1] | low)
+            uncolored &= ~color_class
+            color_classes.append(color_class)
+            if len(color_classes) > k_min:
+                rest = color_class
+                while rest:
+                    low = rest & -rest
+                    branching.append((low.bit_length() - 1, len(color_classes)))
+                    rest ^= low
+        return color_classes, branching
+
+    def is_failed_literal(self, neighbors: int, color_classes: list) -> bool:
+        # color classes as soft clauses of a MaxSAT encoding: a clique through the branching vertex
+        # takes at most one neighbor per class. Unit propagation from the vertex: a class left with
+        # a single neighbor forces it and keeps only its neighbors in the other classes; an emptied
+        # class means that no clique hits all classes, i.e. the bound k_min + 1 drops to k_min
+        adjacency = self.bit_graph.adjacency
+        live = [color_class & neighbors for color_class in color_classes]
+        if not all(live):
+            return True
+        propagated = [False] * len(live)
+        changed = True
+        while changed:
+            changed = False
+            for i, vertices in enumerate(live):
+                if propagated[i] or vertices & (vertices - 1):
+                    continue
+                propagated[i] = changed = True
+                unit_adjacency = adjacency[vertices.bit_length() - 1]
+                for j in range(len(live)):
+                    if j != i:
+                        live[j] &= unit_adjacency
+                        if not live[j]:
+                            return True
+        return False
@@ -0,0 +1,98 @@
+import heapq
+
+
+class Node:
+    # open B&B node: vars fixed to one/zero as bitsets (see BitGraph) and the parent LP bound
+    __slots__ = ('fixed_ones', 'fixed_zeros', 'bound', 'estimate', 'depth', 'is_open', 'branch')
+
+    def __init__(self, fixed_ones: int, fixed_zeros: int, bound: float,
+                 estimate: float = None, depth: int = 0, branch: tuple = None):
+        self.fixed_ones = fixed_ones
+        self.fixed_zeros = fixed_zeros
+        self.bound = bound
+        self.estimate = bound if estimate is None else estimate
+        self.depth = depth
+        self.is_open = True
+        # (var index, value, LP value, parent LP value) of the branch that created the node
+        self.branch = branch
+
+
+class NodeQueue:
+    STRATEGIES = ('dfs', 'best_bound', 'best_estimate', 'hybrid')
+
+    def __init__(self, strategy: str = 'dfs', max_open_nodes: int = None, dive_period: int = 100):
+        assert strategy in self.STRATEGIES, f'Unknown node selection strategy: {strategy}'
+        self.strategy = strategy
+        # once the queue holds more than max_open_nodes, nodes are taken depth-first
+        # (children of the last processed node) until it shrinks back
+        self.max_open_nodes = max_open_nodes
+        # hybrid: best-bound selection with a dive started every dive_period nodes
+        self.dive_period = dive_period
+        self.heap = []
+        self.last_children = []
+        self.size = 0
+        self.max_size = 0
+        self.pushed = 0
+        self.popped = 0
+        self.is_diving = False
+
+    def __len__(self):
+        return self.size
+
+    def priority(self, node: Node) -> tuple:
+        if self.strategy == 'dfs':
+            return (-self.pushed,)
+        elif self.strategy == 'best_estimate':
+            return -node.estimate, -node.depth, -self.pushed
+        return -node.bound, -node.depth, -self.pushed
+
+    def push(self, children: list):
+        # children are given in the order they should be explored
+        self.last_children = []
+        for node in reversed(children):
+            self.pushed += 1
+            node.is_open = True
+            heapq.heappush(self.heap, (self.priority(node), node))
+            self.last_children.append(node)
+        self.size += len(children)
+        self.max_size = max(self.max_size, self.size)
+
+    def pop(self) -> Node:
+        self.popped += 1
+        if self.strategy == 'hybrid' and self.popped % self.dive_period == 0:
+            self.is_diving = True
+        if self.is_diving or (self.max_open_nodes and self.size > self.max_open_nodes):
+            while self.last_children:
+                node = self.last_children.pop()
+                if node.is_open:
+                    return self.close(node)
+            self.is_diving = False
+        while True:
+            _, node = heapq.heappop(self.heap)
+            if node.is_open:
+                return self.close(node)
+
+    def close(self, node: Node) -> Node:
+        node.is_open = False
+        self.size -= 1
+        # drop entries already taken by a dive once they make up most of the heap
+        if len(self.heap) > 2 * self.size + 1024:
+            self.heap = [entry for entry in self.heap if entry[1].is_open]
+            heapq.heapify(self.heap)
+        return node
+
+    def open_nodes(self) -> list:
+        return [node for _, node in self.heap if node.is_open]
+
+    def ordered_nodes(self) -> list:
+        # open nodes in the order they would be popped (dives aside), pushing them into a new
+        # queue in this order restores it
+        return [node for _, node in sorted(self.heap, key=lambda entry: entry[0]) if node.is_open]
+
+    def steal(self, count: int) -> list:
+        # take out the count shallowest open nodes (the largest subtrees) to hand them over
+        stolen = sorted(self.open_nodes(), key=lambda node: node.depth)[:count]
+        for node in stolen:
+            node.is_open = False
+        self.size -= len(stolen)
+        return stolen
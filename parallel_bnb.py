@@ -0,0 +1,211 @@
+import time
+import queue
+import multiprocessing as mp
+
+import utils
+from backend import SolverBackend, make_backend
+from branch_and_bound import BranchAndBound
+
+
+def subtree_worker(graph, backend: str, lazy_pairs: bool, tasks: mp.Queue, results: mp.Queue, incumbent,
+                   pending, idle, deadline: float, share_period: int, bnb_kwargs: dict):
+    # solves subtrees taken from tasks with its own model; while other workers are idle,
+    # half of the open nodes are handed back to tasks every share_period nodes
+    problem = make_backend(backend, graph, threads=1, lazy_pairs=lazy_pairs)
+    problem.design_problem()
+    bnb = BranchAndBound(problem=problem, initial_obj_value=incumbent.value, initial_solution=None,
+                         incumbent=incumbent, **bnb_kwargs)
+    stats = dict(donated=0, subtrees=0, timed_out=False, upper_bound=None)
+
+    def share_work(node_queue):
+        if bnb.call_counter % share_period == 0 and idle.value > 0 and len(node_queue) > 1:
+            nodes = node_queue.steal(len(node_queue) // 2)
+            with pending.get_lock():
+                pending.value += len(nodes)
+            for node in nodes:
+                tasks.put(node)
+            stats['donated'] += len(nodes)
+
+    is_idle = False
+    while deadline is None or time.time() < deadline:
+        try:
+            node = tasks.get(timeout=0.05)
+        except queue.Empty:
+            if not is_idle:
+                is_idle = True
+                with idle.get_lock():
+                    idle.value += 1
+            if pending.value == 0:
+                break
+            continue
+        if is_idle:
+            is_idle = False
+            with idle.get_lock():
+                idle.value -= 1
+        try:
+            bnb.start_time = time.perf_counter()
+            bnb.time_limit = max(deadline - time.time(), 1e-3) if deadline else None
+            bnb.run_iterative([node], on_node=share_work)
+            stats['subtrees'] += 1
+        except utils.TimeoutException as timeout:
+            bnb.on_timeout(timeout)
+            stats['timed_out'] = True
+            stats['upper_bound'] = bnb.upper_bound
+        finally:
+            with pending.get_lock():
+                pending.value -= 1
+        if stats['timed_out']:
+            break
+    else:
+        # the deadline passed between subtrees, tasks may be left in the queue
+        stats['timed_out'] = True
+    if is_idle:
+        with idle.get_lock():
+            idle.value -= 1
+    results.put(dict(best_solution=bnb.best_solution, call_counter=bnb.call_counter,
+                     max_recursion_depth=bnb.max_recursion_depth, coloring_pruned=bnb.coloring_pruned,
+                     lp_pruned=bnb.lp_pruned, node_lp_iterations=bnb.node_lp_iterations,
+                     separation_time=bnb.separation_time, max_queue_size=bnb.max_queue_size,
+                     orbital_fixings=bnb.orbital_fixings, unsolved_nodes=bnb.unsolved_nodes,
+                     unsolved_bound=bnb.unsolved_bound, **stats))
+
+
+class ParallelBranchAndBound:
+
+    def __init__(self, problem: SolverBackend, initial_obj_value: float, initial_solution: list,
+                 n_workers: int = None, nodes_per_worker: int = 4, share_period: int = 50,
+                 time_limit: int = None, progress_callback=None, progress_interval: float = 1.0,
+                 **bnb_kwargs):
+        # the tree is expanded in this process until n_workers * nodes_per_worker nodes are open,
+        # these subtrees are then solved by worker processes sharing the incumbent size
+        self.problem = problem
+        self.best_obj_value = initial_obj_value
+        self.best_solution = initial_solution
+        self.n_workers = n_workers or mp.cpu_count()
+        self.nodes_per_worker = nodes_per_worker
+        self.share_period = share_period
+        self.time_limit = time_limit
+        # events of the split phase come from its BranchAndBound, then from the shared incumbent
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        # workers always explore their subtrees from a node queue
+        self.bnb_kwargs = dict(bnb_kwargs, node_selection=bnb_kwargs.get('node_selection') or 'dfs')
+        self.call_counter = 0
+        self.max_recursion_depth = 0
+        self.coloring_pruned = 0
+        self.lp_pruned = 0
+        self.node_lp_iterations = []
+        self.separation_time = 0.0
+        self.max_queue_size = 0
+        self.cut_pool = None
+        self.donated_nodes = 0
+        self.orbital_fixings = 0
+        self.unsolved_nodes = 0
+        self.unsolved_bound = 0
+        self.timed_out = False
+        self.upper_bound = None
+
+    @utils.timer
+    def timed_run(self):
+        self.run()
+        return
+
+    @property
+    def gap(self) -> float:
+        if self.upper_bound is None:
+            return None
+        return (self.upper_bound - self.best_obj_value) / max(self.best_obj_value, 1)
+
+    def run(self):
+        deadline = time.time() + self.time_limit if self.time_limit else None
+        split_kwargs = dict(self.bnb_kwargs, node_selection='best_bound')
+        bnb = BranchAndBound(problem=self.problem, initial_obj_value=self.best_obj_value,
+                             initial_solution=self.best_solution, time_limit=self.time_limit,
+                             progress_callback=self.progress_callback,
+                             progress_interval=self.progress_interval, **split_kwargs)
+        start_time = bnb.start_time = time.perf_counter()
+        open_nodes = []
+        try:
+            open_nodes = bnb.run_iterative(open_nodes_limit=self.n_workers * self.nodes_per_worker)
+        except utils.TimeoutException as timeout:
+            bnb.on_timeout(timeout)
+        self.collect(vars(bnb))
+        self.cut_pool = bnb.cut_pool
+        self.best_obj_value, self.best_solution = bnb.best_obj_value, bnb.best_solution
+        if bnb.timed_out:
+            self.timed_out, self.upper_bound = True, bnb.upper_bound
+            return
+        if not open_nodes:
+            self.upper_bound = max(bnb.unsolved_upper_bound(), self.best_obj_value)
+            return
+        print(f'Split into {len(open_nodes)} subproblems for {self.n_workers} workers')
+        incumbent = mp.Value('i', self.best_obj_value)
+        pending = mp.Value('i', len(open_nodes))
+        idle = mp.Value('i', 0)
+        tasks, results = mp.Queue(), mp.Queue()
+        for node in open_nodes:
+            tasks.put(node)
+        workers = [mp.Process(target=subtree_worker,
+                              args=(self.problem.graph, self.problem.name, getattr(self.problem, 'lazy_pairs', False),
+                                    tasks, results, incumbent, pending, idle, deadline, self.share_period,
+                                    self.bnb_kwargs))
+                   for _ in range(self.n_workers)]
+        for worker in workers:
+            worker.start()
+        split_bound = max(node.bound for node in open_nodes)
+        worker_results = []
+        while len(worker_results) < len(workers):
+            try:
+                worker_results.append(results.get(timeout=self.progress_interval))
+            except queue.Empty:
+                pass
+            if self.progress_callback is not None:
+                self.progress_callback(dict(elapsed=time.perf_counter() - start_time,
+                                            incumbent=incumbent.value, clique=None,
+                                            upper_bound=max(int(split_bound + bnb.abs_tol), incumbent.value),
+                                            open_nodes=pending.value, nodes=None, nodes_per_second=None))
+        # subtrees never started by the workers, the search is unfinished if there are any. They
+        # are read while the workers exit: a worker that put nodes on tasks only exits once they
+        # are out of the pipe, joining first could wait forever
+        upper_bounds = []
+        while True:
+            is_alive = any(worker.is_alive() for worker in workers)
+            try:
+                upper_bounds.append(int(tasks.get(timeout=0.05).bound + bnb.abs_tol))
+            except queue.Empty:
+                if not is_alive:
+                    break
+        for worker in workers:
+            worker.join()
+        self.timed_out = len(upper_bounds) > 0
+        for result in worker_results:
+            self.collect(result)
+            self.donated_nodes += result['donated']
+            if result['timed_out']:
+                self.timed_out = True
+                # None if the worker stopped between subtrees
+                if result['upper_bound'] is not None:
+                    upper_bounds.append(result['upper_bound'])
+            clique_size = round(sum(result['best_solution'])) if result['best_solution'] else 0
+            if clique_size > self.best_obj_value:
+                self.best_obj_value, self.best_solution = clique_size, result['best_solution']
+        # subtrees of nodes the solver failed on stay open as well
+        if self.unsolved_nodes:
+            upper_bounds.append(int(self.unsolved_bound + bnb.abs_tol))
+        if self.timed_out:
+            print(f'TIMEOUT: >{self.time_limit}s elapsed')
+        upper_bound = min(max(upper_bounds, default=self.best_obj_value), int(bnb.root_bound + bnb.abs_tol))
+        self.upper_bound = max(upper_bound, self.best_obj_value)
+        return
+
+    def collect(self, stats: dict):
+        self.call_counter += stats['call_counter']
+        self.max_recursion_depth = max(self.max_recursion_depth, stats['max_recursion_depth'])
+        self.coloring_pruned += stats['coloring_pruned']
+        self.lp_pruned += stats['lp_pruned']
+        self.node_lp_iterations.extend(stats['node_lp_iterations'])
+        self.separation_time += stats['separation_time']
+        self.max_queue_size = max(self.max_queue_size, stats['max_queue_size'])
+        self.orbital_fixings += stats['orbital_fixings']
+        self.unsolved_nodes += stats['unsolved_nodes']
+        self.unsolved_bound = max(self.unsolved_bound, stats['unsolved_bound'])
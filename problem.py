@@ -1,10 +1,23 @@
+import time
+import tracemalloc
+
 import cplex
 import numpy as np
 import networkx as nx
+import scipy.sparse as sp
+from scipy.sparse.csgraph import breadth_first_order
+
+import utils
+from bitset import BitGraph
+from backend import SolverBackend
+from cuts import PairPool
 
 
-class ProblemHandler:
+class ProblemHandler(SolverBackend):
     problem: cplex.Cplex
+    name = 'cplex'
+    SolverError = cplex.exceptions.CplexSolverError
+    supports_rows = True
     STRATEGIES = [
         nx.coloring.strategy_largest_first,
         nx.coloring.strategy_random_sequential,
@@ -13,26 +26,99 @@ class ProblemHandler:
         nx.coloring.strategy_saturation_largest_first,
     ]
 
-    def __init__(self, graph: nx.Graph, is_integer: bool = False, verbose: bool = False):
+    def __init__(self, graph: nx.Graph, is_integer: bool = False, verbose: bool = False,
+                 threads: int = None, environment: cplex.Cplex = None, lazy_pairs: bool = False,
+                 lazy_max_age: int = 50, lazy_purge_period: int = 20, lazy_max_pairs: int = 200,
+                 lazy_colorings: int = 50, abs_tol: float = 1e-4):
+        super().__init__(graph)
         self.problem = None
-        self.graph = graph
+        # an existing cplex.Cplex object to build the model in (emptied first), saves creating
+        # a CPLEX environment per problem in long-running processes
+        self.environment = environment
         self.is_integer = is_integer
         self.verbose = verbose
+        self.threads = threads
+        # lazy_pairs builds the model with the independent set rows only; every solve adds the
+        # violated x_i + x_j <= 1 rows (up to lazy_max_pairs per round) and solves again until
+        # none is left. Rows slack for lazy_max_age solves are deleted every lazy_purge_period solves.
+        # The model starts from the color classes of lazy_colorings random colorings; fewer give a
+        # smaller model but a weaker bound
+        self.lazy_pairs = lazy_pairs
+        self.lazy_max_age = lazy_max_age
+        self.lazy_purge_period = lazy_purge_period
+        self.lazy_max_pairs = lazy_max_pairs
+        self.lazy_colorings = lazy_colorings
+        self.abs_tol = abs_tol
+        self.pair_pool = None
+        self.lazy_solution = None
+        self.expired_pairs = []
+        self.lazy_solves = 0
+        self.lazy_rounds = 0
+        self.lazy_iterations = 0
+        self.separation_time = 0.0
+        # rows of the built model, and the number of row deletions since (bases taken before a
+        # deletion can't be reused)
+        self.build_constraints = None
+        self.row_deletions = 0
         return
 
-    def solve_problem(self) -> float:
+    def solve_problem(self, lower_bound: float = None) -> float:
+        # the LP value is an upper bound whatever lower_bound is
         if self.problem:
+            if self.pair_pool is not None:
+                return self.solve_lazy(lower_bound)
             self.problem.solve()
+            if self.problem.solution.get_status() == self.problem.solution.status.abort_time_limit:
+                raise utils.TimeoutException(best_clique_size=None, msg='TIMEOUT: CPLEX time limit reached')
             return self.problem.solution.get_objective_value()
         else:
             raise "Problem is not constructed yet"
 
+    def solve_lazy(self, lower_bound: float = None) -> float:
+        # solve until no pair row is violated, or the LP value (which only decreases as rows are
+        # added) can't beat lower_bound; the solution of the last solve stays available
+        self.lazy_solves += 1
+        if self.expired_pairs and self.lazy_solves % self.lazy_purge_period == 0:
+            self.remove_constraint(self.expired_pairs)
+            self.expired_pairs = []
+        self.lazy_iterations = 0
+        while True:
+            self.problem.solve()
+            if self.problem.solution.get_status() == self.problem.solution.status.abort_time_limit:
+                raise utils.TimeoutException(best_clique_size=None, msg='TIMEOUT: CPLEX time limit reached')
+            self.lazy_iterations += self.problem.solution.progress.get_num_iterations()
+            obj_value = self.problem.solution.get_objective_value()
+            # kept for get_solution, the rows are aged from it too
+            self.lazy_solution = np.asarray(self.problem.solution.get_values())
+            if lower_bound is not None and int(obj_value + self.abs_tol) <= lower_bound:
+                break
+            tic = time.perf_counter()
+            pairs = self.pair_pool.separate(self.lazy_solution)
+            self.separation_time += time.perf_counter() - tic
+            if not pairs:
+                break
+            names, var_indexes_list = zip(*pairs)
+            self.add_set_constraints(list(var_indexes_list), list(names))
+            self.lazy_rounds += 1
+        names = self.pair_pool.names()
+        if names:
+            slacks = self.pair_pool.slacks(names, self.lazy_solution)
+            self.expired_pairs.extend(self.pair_pool.update_ages(names, slacks))
+        return obj_value
+
     def get_solution(self) -> list:
         if self.problem:
+            if self.pair_pool is not None:
+                return self.lazy_solution.tolist()
             return self.problem.solution.get_values()
         else:
             raise "Problem is not constructed yet"
 
+    def get_solution_array(self) -> np.ndarray:
+        if self.pair_pool is not None:
+            return self.lazy_solution.copy()
+        return super().get_solution_array()
+
     def add_integer_constraint(self, var_name: str, constraint_name: str,
                                rhs: float = 1.0):
         constraint = [[var_name], [1.0]]
@@ -43,59 +129,168 @@ class ProblemHandler:
         else:
             raise "Problem is not constructed yet"
 
+    def add_set_constraints(self, var_indexes_list: list, constraint_names: list):
+        # rows sum(x_i) <= 1 given by var indexes
+        one = 1 if self.is_integer else 1.0
+        constraints = [cplex.SparsePair(ind=var_indexes, val=[1.0] * len(var_indexes))
+                       for var_indexes in var_indexes_list]
+        if self.problem:
+            self.problem.linear_constraints.add(lin_expr=constraints, senses=['L'] * len(constraints),
+                                                rhs=[one] * len(constraints), names=constraint_names)
+            return
+        else:
+            raise "Problem is not constructed yet"
+
+    def get_slacks(self, constraint_names: list) -> list:
+        if self.problem:
+            return self.problem.solution.get_linear_slacks(constraint_names)
+        else:
+            raise "Problem is not constructed yet"
+
     def remove_constraint(self, constraint_name):
         if self.problem:
             self.problem.linear_constraints.delete(constraint_name)
+            self.row_deletions += 1
+            return
+        else:
+            raise "Problem is not constructed yet"
+
+    def fix_variables(self, var_indexes: list, value: float):
+        # fix vars by collapsing their bounds, the basis of the last solve stays valid for dual simplex
+        if self.problem:
+            if var_indexes:
+                self.problem.variables.set_lower_bounds([(i, value) for i in var_indexes])
+                self.problem.variables.set_upper_bounds([(i, value) for i in var_indexes])
+            return
+        else:
+            raise "Problem is not constructed yet"
+
+    def restore_bounds(self, var_indexes: list):
+        one = 1 if self.is_integer else 1.0
+        zero = 0 if self.is_integer else 0.0
+        if self.problem:
+            if var_indexes:
+                self.problem.variables.set_lower_bounds([(i, zero) for i in var_indexes])
+                self.problem.variables.set_upper_bounds([(i, one) for i in var_indexes])
             return
         else:
             raise "Problem is not constructed yet"
 
-    def design_problem(self, filtered_limit: int = 20000):
+    def get_basis(self) -> tuple:
+        if self.problem:
+            return self.problem.solution.basis.get_basis() + (self.row_deletions,)
+        else:
+            raise "Problem is not constructed yet"
+
+    def set_basis(self, basis: tuple):
+        col_status, row_status, row_deletions = basis
+        if self.problem:
+            # rows added since the basis was taken start with their slack basic; after a deletion
+            # the rows of the basis are unknown
+            num_rows = self.problem.linear_constraints.get_num()
+            if row_deletions == self.row_deletions and len(row_status) <= num_rows:
+                row_status = list(row_status) + [self.problem.start.status.basic] * (num_rows - len(row_status))
+                self.problem.start.set_start(col_status=col_status, row_status=row_status,
+                                             col_primal=[], row_primal=[], col_dual=[], row_dual=[])
+            return
+        else:
+            raise "Problem is not constructed yet"
+
+    def get_num_iterations(self) -> int:
+        if self.problem:
+            if self.pair_pool is not None:
+                return self.lazy_iterations
+            return self.problem.solution.progress.get_num_iterations()
+        else:
+            raise "Problem is not constructed yet"
+
+    def set_time_limit(self, seconds: float):
+        if self.problem:
+            if seconds is None:
+                self.problem.parameters.timelimit.reset()
+            else:
+                self.problem.parameters.timelimit.set(max(seconds, 1e-3))
+            return
+        else:
+            raise "Problem is not constructed yet"
+
+    def design_problem(self, block_size: int = 1024, trace_memory: bool = False):
+        tic = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start()
         # specify numeric type for ILP/LP problem
         one = 1 if self.is_integer else 1.0
         zero = 0 if self.is_integer else 0.0
-        # get not connected edges and list of independent sets
-        not_connected = self.get_complement_edges(self.graph)
-        independent_sets = self.get_independent_sets(self.graph, strategies=self.STRATEGIES)
-        print(f'PAIRS: {len(not_connected)} IND SETS: {len(independent_sets)}')
-        not_connected = self.filter_repeated(not_connected, independent_sets)
-        print(f'FILTERED PAIRS: {len(not_connected)}')
+        # get not connected pairs of var indexes and list of independent sets
+        adjacency = self.get_adjacency(self.graph)
+        if self.lazy_pairs:
+            # pair rows are separated by solve_problem, the complement is never listed
+            independent_sets = self.get_independent_sets(self.graph, strategies=self.STRATEGIES,
+                                                         n_iter=self.lazy_colorings)
+            independent_sets = [sorted(node - 1 for node in ind_set) for ind_set in independent_sets]
+            not_connected = np.empty((0, 2), dtype=np.int64)
+            self.pair_pool = PairPool(adjacency, max_age=self.lazy_max_age, max_cuts=self.lazy_max_pairs,
+                                      abs_tol=self.abs_tol, block_size=block_size)
+            self.expired_pairs = []
+            print(f'LAZY PAIRS, IND SETS: {len(independent_sets)}')
+        else:
+            not_connected = self.get_complement_edges(adjacency, block_size=block_size)
+            independent_sets = self.get_independent_sets(self.graph, strategies=self.STRATEGIES)
+            print(f'PAIRS: {len(not_connected)} IND SETS: {len(independent_sets)}')
+            # node i is var index i - 1
+            independent_sets = [sorted(node - 1 for node in ind_set) for ind_set in independent_sets]
+            not_connected = self.filter_repeated(not_connected, independent_sets, n_vars=adjacency.shape[0])
+            print(f'FILTERED PAIRS: {len(not_connected)}')
         nodes = sorted(self.graph.nodes())
-        n_vars = self.graph.number_of_nodes()
+        n_vars = adjacency.shape[0]
         n_constraints = len(not_connected) + len(independent_sets)
         # define upper and lower bounds for vars
         upper_bounds = [one] * n_vars
         lower_bounds = [zero] * n_vars
         # define objective x_1 + x_2 + ... + x_n -> max
         obj = [one] * n_vars
-        # define var and constraint names
         var_names = [f'x{i}' for i in nodes]
-        constraint_names = [f'c{i + 1}' for i in range(n_constraints)]
         # constraint type L is less than, i. e. x_i + x_j <= 1
         constraint_senses = ['L'] * n_constraints
         right_hand_side = [one] * n_constraints
         # initialize cplex solver
-        problem = cplex.Cplex()
+        problem = self.reset(self.environment) if self.environment is not None else cplex.Cplex()
         # add vars, obj and bounds
         problem.variables.add(obj=obj, names=var_names, ub=upper_bounds, lb=lower_bounds)
-        # collect constraints and var types
-        constraints = []
-        for ind_set in independent_sets:
-            constraints.append([[f'x{i}' for i in ind_set], [1.0] * len(ind_set)])
-        for node_i, node_j in not_connected:
-            constraints.append([[f'x{node_i}', f'x{node_j}'], [1.0, 1.0]])
-        _type = problem.variables.type.binary if self.is_integer else problem.variables.type.continuous
-        for node in nodes:
-            problem.variables.set_types(f'x{node}', _type)
-        # add constraints and var types
-        problem.linear_constraints.add(lin_expr=constraints, senses=constraint_senses,
-                                       rhs=right_hand_side, names=constraint_names)
+        # collect index-based constraints
+        constraints = [cplex.SparsePair(ind=ind_set, val=[1.0] * len(ind_set)) for ind_set in independent_sets]
+        constraints.extend(cplex.SparsePair(ind=pair, val=[1.0, 1.0]) for pair in not_connected.tolist())
+        # vars are continuous by default; setting their type at all would turn the LP into a MILP
+        # (solved without a simplex basis to warm start from)
+        if self.is_integer:
+            problem.variables.set_types([(i, problem.variables.type.binary) for i in range(n_vars)])
+        problem.linear_constraints.add(lin_expr=constraints, senses=constraint_senses, rhs=right_hand_side)
+        self.build_constraints = n_constraints
+        self.row_deletions = 0
         # set objective func as maximization problem
         problem.objective.set_sense(problem.objective.sense.maximize)
+        # after a bound change the previous optimal basis stays dual feasible
+        problem.parameters.lpmethod.set(problem.parameters.lpmethod.values.dual)
+        if self.threads:
+            problem.parameters.threads.set(self.threads)
         self.problem = problem
         self.set_verbosity()
+        if trace_memory:
+            self.build_peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        self.build_time = time.perf_counter() - tic
         return
 
+    @staticmethod
+    def reset(problem: cplex.Cplex) -> cplex.Cplex:
+        # empty LP with default parameters
+        problem.linear_constraints.delete()
+        problem.variables.delete()
+        problem.parameters.reset()
+        if problem.get_problem_type() != problem.problem_type.LP:
+            problem.set_problem_type(problem.problem_type.LP)
+        return problem
+
     def set_verbosity(self):
         if not self.verbose:
             self.problem.set_log_stream(None)
@@ -104,40 +299,75 @@ class ProblemHandler:
             self.problem.set_error_stream(None)
 
     @staticmethod
-    def get_complement_edges(graph: nx.Graph) -> list:
-        complement_g = nx.complement(graph)
-        adj_matrix = nx.adjacency_matrix(complement_g).todense()
-        adj_matrix = np.triu(adj_matrix, k=1)
-        pairs = np.where(adj_matrix == 1)
-        complement_edges = list(zip(pairs[0] + 1, pairs[1] + 1))
-        return complement_edges
+    def get_adjacency(graph: nx.Graph) -> sp.csr_matrix:
+        # sparse adjacency with row/column i standing for node i + 1
+        return utils.adjacency_matrix(graph)
+
+    @staticmethod
+    def get_complement_edges(adjacency: sp.csr_matrix, block_size: int = 1024) -> np.ndarray:
+        # (i, j), i < j pairs of not connected var indexes, densified by blocks of rows
+        num_of_nodes = adjacency.shape[0]
+        pairs = [np.empty((0, 2), dtype=np.int64)]
+        for start in range(0, num_of_nodes, block_size):
+            block = adjacency[start:start + block_size].toarray()
+            rows, cols = np.nonzero(~block)
+            rows += start
+            upper = cols > rows
+            pairs.append(np.stack([rows[upper], cols[upper]], axis=1))
+        return np.concatenate(pairs)
 
     @staticmethod
-    def filter_repeated(pairs, ind_sets, filtered_limit: int = 500000) -> list:
-        new_pairs = []
-        for _iter, pair in enumerate(pairs):
-            absence_flag = True
-            if _iter < filtered_limit:
-                for ind_set in ind_sets:
-                    if pair[0] in ind_set:
-                        if pair[1] in ind_set:
-                            absence_flag = False
-                            break
-            if absence_flag:
-                new_pairs.append(pair)
-        return new_pairs
+    def filter_repeated(pairs: np.ndarray, ind_sets: list, n_vars: int) -> np.ndarray:
+        # drop pairs lying in a common independent set: membership matrix M (vars x sets),
+        # a pair (i, j) is covered iff (M M^T)_ij > 0
+        if len(pairs) == 0 or len(ind_sets) == 0:
+            return pairs
+        rows = np.concatenate([np.asarray(ind_set, dtype=np.int64) for ind_set in ind_sets])
+        cols = np.repeat(np.arange(len(ind_sets)), [len(ind_set) for ind_set in ind_sets])
+        membership = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                   shape=(n_vars, len(ind_sets)))
+        covered = sp.triu(membership @ membership.T, k=1).tocoo()
+        covered_keys = covered.row.astype(np.int64) * n_vars + covered.col
+        pair_keys = pairs[:, 0] * n_vars + pairs[:, 1]
+        return pairs[~np.isin(pair_keys, covered_keys)]
+
+    @staticmethod
+    def greedy_color(graph: nx.Graph, strategy, bit_graph: BitGraph = None) -> dict:
+        # node -> color; graphs given as CSR arrays are colored on bitsets without networkx,
+        # strategies that are not a plain vertex ordering fall back to largest first there
+        if isinstance(graph, nx.Graph):
+            return nx.coloring.greedy_color(graph, strategy=strategy)
+        if bit_graph is None:
+            bit_graph = BitGraph(graph)
+        if strategy == nx.coloring.strategy_random_sequential:
+            var_order = np.random.permutation(graph.number_of_nodes())
+        elif strategy == nx.coloring.strategy_connected_sequential_bfs:
+            adjacency = graph.adjacency()
+            visited = np.zeros(graph.number_of_nodes(), dtype=np.bool_)
+            var_order = []
+            for start in range(graph.number_of_nodes()):
+                if not visited[start]:
+                    component = breadth_first_order(adjacency, start, directed=False,
+                                                    return_predecessors=False)
+                    visited[component] = True
+                    var_order.extend(component.tolist())
+        else:
+            var_order = bit_graph.index_of_bit
+        colors = bit_graph.sequential_coloring(list(var_order))
+        return {var_index + 1: color for var_index, color in enumerate(colors)}
 
     @staticmethod
     def get_independent_sets(graph: nx.Graph, strategies: list,
                              n_iter: int = 50, min_set_size: int = 3) -> list:
         independent_sets = set()
+        bit_graph = None if isinstance(graph, nx.Graph) else BitGraph(graph)
         for strategy in strategies:
             if strategy == nx.coloring.strategy_random_sequential:
                 _n_iter = n_iter
             else:
                 _n_iter = 1
             for _ in range(_n_iter):
-                coloring_dct = nx.coloring.greedy_color(graph, strategy=strategy)
+                coloring_dct = ProblemHandler.greedy_color(graph, strategy=strategy, bit_graph=bit_graph)
                 color2nodes = dict()
                 for node, color in coloring_dct.items():
                     if color not in color2nodes:
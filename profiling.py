@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import signal
+import cProfile
+import collections
+
+import numpy as np
+
+
+class Phase:
+    # reusable timing context of one phase; durations go to a histogram if requested
+    __slots__ = ('profiler', 'name', 'histogram', 'tic')
+
+    def __init__(self, profiler, name: str, histogram: bool):
+        self.profiler = profiler
+        self.name = name
+        self.histogram = histogram
+        self.tic = None
+
+    def __enter__(self):
+        self.tic = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed_time = time.perf_counter() - self.tic
+        self.profiler.times[self.name] += elapsed_time
+        self.profiler.calls[self.name] += 1
+        if self.histogram:
+            self.profiler.values[f'{self.name}_time'].append(elapsed_time)
+        return False
+
+
+class NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class Profiler:
+    # wall time and call count per solver phase plus value histograms (node depth, LP time);
+    # a disabled profiler hands out one shared no-op context, so instrumented code stays cheap
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.times = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.values = collections.defaultdict(list)
+        self.phases = dict()
+
+    def phase(self, name: str, histogram: bool = False):
+        if not self.enabled:
+            return NULL_PHASE
+        if name not in self.phases:
+            self.phases[name] = Phase(self, name, histogram)
+        return self.phases[name]
+
+    def record(self, name: str, value: float):
+        if self.enabled:
+            self.values[name].append(value)
+
+    def summary(self, prefix: str = 'prof_') -> dict:
+        # flat columns for the results table: seconds and calls per phase, percentiles and
+        # a power-of-two histogram per recorded value (JSON text, so CSV/XLSX cells read back)
+        result = dict()
+        for name in self.times:
+            result[f'{prefix}{name}_seconds'] = self.times[name]
+            result[f'{prefix}{name}_calls'] = self.calls[name]
+        for name, values in self.values.items():
+            values = np.asarray(values, dtype=float)
+            result[f'{prefix}{name}_p50'] = float(np.percentile(values, 50))
+            result[f'{prefix}{name}_p90'] = float(np.percentile(values, 90))
+            result[f'{prefix}{name}_max'] = float(values.max())
+            result[f'{prefix}{name}_histogram'] = json.dumps(log2_histogram(values))
+        return result
+
+
+NULL_PROFILER = Profiler(enabled=False)
+
+
+def log2_histogram(values: np.ndarray) -> dict:
+    # counts per power-of-two bucket [2^k, 2^(k+1)), keyed by the lower edge
+    positive = values[values > 0]
+    buckets = np.floor(np.log2(positive)).astype(int)
+    edges, counts = np.unique(buckets, return_counts=True)
+    histogram = {0: int((values <= 0).sum())} if (values <= 0).any() else dict()
+    histogram.update({float(2.0 ** edge): int(count) for edge, count in zip(edges, counts)})
+    return histogram
+
+
+class StackSampler:
+    # statistical profiler: the python stack is sampled on SIGPROF every interval seconds of CPU
+    # time and written as collapsed stacks ("outer;inner count" lines, flamegraph.pl input).
+    # Unix only, must run in the main thread
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.stacks = collections.Counter()
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, *exc_info):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        return False
+
+    def dump(self, path: str):
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+def profile_call(func, output_path: str = None):
+    # run func() under cProfile (output_path *.prof, pstats format) or the stack sampler
+    # (any other path, collapsed stacks); without output_path func runs as is
+    if output_path is None:
+        return func()
+    if output_path.endswith('.prof'):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func)
+        finally:
+            profile.dump_stats(output_path)
+    sampler = StackSampler()
+    try:
+        with sampler:
+            return func()
+    finally:
+        sampler.dump(output_path)
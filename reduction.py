@@ -0,0 +1,106 @@
+import time
+import numpy as np
+import networkx as nx
+
+import utils
+from bitset import BitGraph
+from dimacs import CSRGraph
+
+
+class GraphReducer:
+    RULES = ('degree', 'coloring', 'dominance')
+
+    def __init__(self, graph: nx.Graph, lower_bound: int, rules: tuple = RULES):
+        # removes vertices that cannot be in a clique larger than lower_bound (or are not needed
+        # for one) until no rule applies; graph is nx.Graph or dimacs.CSRGraph
+        self.graph = graph
+        self.lower_bound = lower_bound
+        self.rules = rules
+        self.bit_graph = BitGraph(graph)
+        self.alive = self.bit_graph.all_nodes
+        self.removed = {rule: dict(nodes=0, edges=0) for rule in self.RULES}
+        self.kept = None
+        self.reduction_time = None
+
+    def run(self) -> CSRGraph:
+        # returns the remaining graph relabeled to nodes 1..n'
+        tic = time.perf_counter()
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.rules:
+                changed = getattr(self, f'apply_{rule}')() > 0 or changed
+        self.kept = np.array(self.bit_graph.to_var_indexes(self.alive), dtype=np.int64)
+        adjacency = utils.adjacency_matrix(self.graph)[self.kept][:, self.kept].tocsr()
+        reduced_graph = CSRGraph(len(self.kept), adjacency.indptr.astype(np.int64),
+                                 adjacency.indices.astype(np.int32))
+        self.reduction_time = time.perf_counter() - tic
+        print(f'REDUCED: {self.bit_graph.num_of_nodes} -> {len(self.kept)} nodes')
+        return reduced_graph
+
+    def remove(self, bit: int, rule: str):
+        self.removed[rule]['nodes'] += 1
+        self.removed[rule]['edges'] += bin(self.bit_graph.adjacency[bit] & self.alive).count('1')
+        self.alive &= ~(1 << bit)
+
+    def alive_bits(self) -> list:
+        bits = []
+        rest = self.alive
+        while rest:
+            low = rest & -rest
+            bits.append(low.bit_length() - 1)
+            rest ^= low
+        return bits
+
+    def apply_degree(self) -> int:
+        # k-core peeling: a vertex of a clique larger than k has at least k neighbors
+        removed = 0
+        changed = True
+        while changed:
+            changed = False
+            for bit in self.alive_bits():
+                if bin(self.bit_graph.adjacency[bit] & self.alive).count('1') < self.lower_bound:
+                    self.remove(bit, 'degree')
+                    removed += 1
+                    changed = True
+        return removed
+
+    def apply_coloring(self) -> int:
+        # the neighborhood of a vertex of a clique larger than k needs at least k colors
+        removed = 0
+        for bit in self.alive_bits():
+            neighbors = self.bit_graph.adjacency[bit] & self.alive
+            colors = self.bit_graph.coloring_bound(neighbors, limit=self.lower_bound - 1)
+            if 1 + colors <= self.lower_bound:
+                self.remove(bit, 'coloring')
+                removed += 1
+        return removed
+
+    def apply_dominance(self) -> int:
+        # u is dominated by a non-adjacent v if every neighbor of u is a neighbor of v: swapping
+        # u for v keeps any clique a clique, so u can go. The dominators of u are the vertices
+        # adjacent to all of u's neighbors
+        removed = 0
+        adjacency = self.bit_graph.adjacency
+        for bit in self.alive_bits():
+            dominators = self.alive & ~(adjacency[bit] | 1 << bit)
+            neighbors = adjacency[bit] & self.alive
+            while neighbors and dominators:
+                low = neighbors & -neighbors
+                neighbors ^= low
+                dominators &= adjacency[low.bit_length() - 1]
+            if dominators:
+                self.remove(bit, 'dominance')
+                removed += 1
+        return removed
+
+    def to_original(self, solution: list) -> list:
+        original = np.zeros(self.bit_graph.num_of_nodes)
+        original[self.kept] = solution
+        return original.tolist()
+
+    def to_original_nodes(self, nodes: list) -> list:
+        return [int(self.kept[node - 1]) + 1 for node in nodes]
+
+    def to_reduced(self, solution: list) -> list:
+        return np.asarray(solution, dtype=float)[self.kept].tolist()
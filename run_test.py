@@ -1,63 +1,274 @@
+import os
+import glob
+import json
+import time
+import signal
+import numpy as np
 import pandas as pd
 from pprint import pprint
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from problem import ProblemHandler
+from backend import make_backend
 from heuristic import HeuristicMaxClique
 from branch_and_bound import BranchAndBound
+from parallel_bnb import ParallelBranchAndBound
+from reduction import GraphReducer
+from symmetry import Symmetry
 from benchmarks import EASY, MEDIUM, HARD
+from dimacs import load_dimacs
+from checkpoint import load_checkpoint
+from profiling import Profiler, profile_call
 from utils import *
 
 
-def run_test(benchmark: str, abs_tol: float = 1e-4, time_limit: int = None):
+def run_test(benchmark: str, abs_tol: float = 1e-4, time_limit: int = None,
+             node_selection: str = None, max_open_nodes: int = None, separate_cuts: bool = False,
+             trace_memory: bool = False, threads: int = None, parallel_workers: int = None,
+             reduce_graph: bool = True, backend: str = 'cplex', progress_callback=None,
+             progress_interval: float = 1.0, checkpoint_path: str = None, checkpoint_interval: float = 10.0,
+             resume: bool = False, profile: bool = False, profile_output: str = None,
+             branching_rule: str = 'closest_to_one', seed: int = None, symmetry: bool = False,
+             symmetry_time_limit: float = 10.0, lazy_pairs: bool = False):
+    assert not (checkpoint_path and parallel_workers), 'Checkpoints are written by the sequential search only'
     print(f'{benchmark} started...')
-    graph = read_graph_file(benchmark, verbose=False)
-    problem_handler = ProblemHandler(graph=graph)
-    problem_handler.design_problem()
-    print('Problem constructed!')
-    heuristic = HeuristicMaxClique(graph)
-    heuristic_clique = heuristic.run()
+    graph = load_dimacs(benchmark)
+    resume_state = load_checkpoint(checkpoint_path) if resume and os.path.exists(checkpoint_path) else None
+    # per-phase timings become prof_* columns; profile_output also gets a cProfile dump (*.prof)
+    # or collapsed stacks of the B&B run
+    profiler = Profiler(enabled=profile or profile_output is not None)
+    # seed fixes the heuristic and the random colorings of the model
+    if seed is not None:
+        np.random.seed(seed)
+    heuristic_time = time.perf_counter()
+    if resume_state is None:
+        with profiler.phase('heuristic'):
+            heuristic = HeuristicMaxClique(graph, seed=seed)
+            heuristic_clique = heuristic.run()
+    else:
+        # the reduced graph the checkpoint refers to depends on the heuristic clique
+        heuristic_clique = resume_state['extra']['heuristic_clique']
     heuristic_clique_size = int(sum(heuristic_clique))
+    heuristic_time = time.perf_counter() - heuristic_time
     print(f'Found heuristic solution! ({heuristic_clique_size})')
-    bnb_algorithm = BranchAndBound(problem=problem_handler,
-                                   initial_solution=heuristic_clique, time_limit=time_limit,
-                                   initial_obj_value=heuristic_clique_size, abs_tol=abs_tol)
-    exec_time = bnb_algorithm.timed_run()
+    # B&B only has to look for cliques larger than the heuristic one
+    reducer = GraphReducer(graph, lower_bound=heuristic_clique_size) if reduce_graph else None
+    with profiler.phase('reduction'):
+        bnb_graph = reducer.run() if reducer else graph
+    problem_handler = make_backend(backend, bnb_graph, threads=threads, lazy_pairs=lazy_pairs)
+    with profiler.phase('model_build'):
+        problem_handler.design_problem(trace_memory=trace_memory)
+    print('Problem constructed!')
+    # orbits and twins of the graph B&B runs on, for orbital fixing
+    graph_symmetry = None
+    if symmetry:
+        with profiler.phase('symmetry'):
+            graph_symmetry = Symmetry(bnb_graph, time_limit=symmetry_time_limit)
+
+    def on_progress(event: dict):
+        # report cliques of the original graph
+        if event['incumbent'] <= heuristic_clique_size:
+            event['clique'] = to_node_indexes(heuristic_clique)
+        elif reducer and event['clique'] is not None:
+            event['clique'] = reducer.to_original_nodes(event['clique'])
+        progress_callback(dict(benchmark=benchmark.split('/')[-1], **event))
+
+    bnb_kwargs = dict(problem=problem_handler,
+                      initial_solution=reducer.to_reduced(heuristic_clique) if reducer else heuristic_clique,
+                      time_limit=time_limit,
+                      initial_obj_value=heuristic_clique_size, abs_tol=abs_tol,
+                      node_selection=node_selection, max_open_nodes=max_open_nodes,
+                      separate_cuts=separate_cuts, progress_interval=progress_interval,
+                      progress_callback=on_progress if progress_callback else None, profiler=profiler,
+                      branching_rule=branching_rule, symmetry=graph_symmetry)
+    if checkpoint_path:
+        bnb_kwargs.update(checkpoint_path=checkpoint_path, checkpoint_interval=checkpoint_interval,
+                          checkpoint_extra=dict(heuristic_clique=heuristic_clique), resume_state=resume_state)
+    if parallel_workers:
+        bnb_algorithm = ParallelBranchAndBound(n_workers=parallel_workers, **bnb_kwargs)
+    else:
+        bnb_algorithm = BranchAndBound(**bnb_kwargs)
+    exec_time = profile_call(bnb_algorithm.timed_run, profile_output)
     _minutes, _seconds = divmod(exec_time, 60)
-    clique_nodes = to_node_indexes(bnb_algorithm.best_solution)
+    cut_pool = bnb_algorithm.cut_pool
+    pair_pool = getattr(problem_handler, 'pair_pool', None)
+    if bnb_algorithm.best_obj_value <= heuristic_clique_size:
+        best_solution = heuristic_clique
+    elif reducer:
+        best_solution = reducer.to_original(bnb_algorithm.best_solution)
+    else:
+        best_solution = bnb_algorithm.best_solution
+    clique_nodes = to_node_indexes(best_solution)
     _result = dict(benchmark=benchmark.split('/')[-1],
                    heuristic_clique_size=heuristic_clique_size,
+                   heuristic_time_seconds=heuristic_time,
+                   reduced_nodes=bnb_graph.number_of_nodes(),
+                   reduced_edges=bnb_graph.number_of_edges(),
+                   reduction_time_seconds=reducer.reduction_time if reducer else None,
+                   **{f'removed_{rule}_{item}': count
+                      for rule, removed in (reducer.removed.items() if reducer else [])
+                      for item, count in removed.items()},
+                   build_time_seconds=problem_handler.build_time,
+                   build_peak_memory_mb=problem_handler.build_peak_memory,
+                   build_constraints=getattr(problem_handler, 'build_constraints', None),
                    bnb_clique_size=bnb_algorithm.best_obj_value,
+                   bnb_clique=clique_nodes,
+                   bnb_timed_out=bnb_algorithm.timed_out,
+                   bnb_upper_bound=bnb_algorithm.upper_bound,
+                   bnb_gap=bnb_algorithm.gap,
+                   bnb_unsolved_nodes=bnb_algorithm.unsolved_nodes,
+                   bnb_resumed=resume_state is not None,
+                   bnb_checkpoints_written=getattr(bnb_algorithm, 'checkpoints_written', None),
+                   bnb_checkpoint_time=getattr(bnb_algorithm, 'checkpoint_time', None),
                    is_bnb_solution_clique=is_clique(graph, clique_nodes),
                    bnb_exec_time=f'{_minutes:.0f}min {_seconds:.1f}sec',
                    bnb_exec_time_seconds=exec_time,
                    bnb_call_count=bnb_algorithm.call_counter,
                    bnb_max_recursion_depth=bnb_algorithm.max_recursion_depth,
+                   bnb_coloring_pruned=bnb_algorithm.coloring_pruned,
+                   bnb_lp_pruned=bnb_algorithm.lp_pruned,
+                   bnb_lp_iterations=sum(bnb_algorithm.node_lp_iterations),
+                   bnb_cuts_added=cut_pool.cuts_added if cut_pool else None,
+                   bnb_cut_pool_size=cut_pool.max_pool_size if cut_pool else None,
+                   bnb_separation_time=bnb_algorithm.separation_time,
+                   bnb_max_queue_size=bnb_algorithm.max_queue_size,
+                   symmetry_orbits=graph_symmetry.num_orbits() if graph_symmetry else None,
+                   symmetry_twin_classes=len(graph_symmetry.twins) if graph_symmetry else None,
+                   symmetry_time_seconds=graph_symmetry.detection_time if graph_symmetry else None,
+                   bnb_orbital_fixings=bnb_algorithm.orbital_fixings,
+                   bnb_lp_iterations_per_node=np.mean(bnb_algorithm.node_lp_iterations or [0]),
+                   native_maxsat_pruned=getattr(problem_handler, 'maxsat_pruned', None),
+                   lazy_pairs_added=pair_pool.cuts_added if pair_pool else None,
+                   lazy_pairs_removed=pair_pool.cuts_removed if pair_pool else None,
+                   lazy_pool_size=pair_pool.max_pool_size if pair_pool else None,
+                   lazy_rounds=problem_handler.lazy_rounds if pair_pool else None,
+                   lazy_separation_time=problem_handler.separation_time if pair_pool else None,
+                   **profiler.summary(),
                    )
     return _result
 
 
+def run_benchmark(filepath: str, true_clique_size: int, **kwargs) -> dict:
+    try:
+        result_dct = run_test(filepath, **kwargs)
+        result_dct['true_clique_size'] = true_clique_size
+        pprint(result_dct)
+    except TimeoutException as timeout:
+        print(filepath, timeout.msg)
+        result_dct = dict(benchmark=filepath.split('/')[-1],
+                          bnb_exec_time=timeout.msg,
+                          bnb_clique_size=timeout.best_clique_size,
+                          true_clique_size=true_clique_size)
+    return result_dct
+
+
 def run_tests(benchmarks: list, time_limit: int = None, abs_tol: float = 1e-4,
-              out_folder: str = 'results/', suffix: str = ''):
+              out_folder: str = 'results/', suffix: str = '', node_selection: str = None,
+              separate_cuts: bool = False, profile: bool = False):
     results = []
     for filepath in benchmarks:
-        try:
-            result_dct = run_test(filepath, abs_tol=abs_tol, time_limit=time_limit)
-            result_dct['true_clique_size'] = benchmarks[filepath]
-            pprint(result_dct)
-            results.append(result_dct)
-        except TimeoutException as timeout:
-            print(filepath, timeout.msg)
-            results.append(dict(benchmark=filepath.split('/')[-1],
-                                bnb_exec_time=timeout.msg,
-                                bnb_clique_size=timeout.best_clique_size,
-                                true_clique_size=benchmarks[filepath]))
+        results.append(run_benchmark(filepath, benchmarks[filepath], abs_tol=abs_tol, time_limit=time_limit,
+                                     node_selection=node_selection, separate_cuts=separate_cuts,
+                                     profile=profile))
         result_df = pd.DataFrame(results)
         result_df.to_csv(out_folder + f'results_{suffix}.csv')
         result_df.to_excel(out_folder + f'results_{suffix}.xlsx')
     return
 
 
+def run_benchmark_job(filepath: str, true_clique_size: int, hard_time_limit: int = None, **kwargs) -> dict:
+    # executed in a worker process; B&B stops itself at time_limit, SIGALRM also bounds
+    # model construction and heuristic at hard_time_limit
+    def on_alarm(signum, frame):
+        raise TimeoutException(best_clique_size=None, msg=f'TIMEOUT: >{hard_time_limit}s (hard limit)')
+
+    if hard_time_limit:
+        signal.signal(signal.SIGALRM, on_alarm)
+        signal.alarm(hard_time_limit)
+    try:
+        result_dct = run_benchmark(filepath, true_clique_size, **kwargs)
+    finally:
+        if hard_time_limit:
+            signal.alarm(0)
+    result_dct['filepath'] = filepath
+    return result_dct
+
+
+def previous_exec_times(out_folder: str = 'results/') -> dict:
+    # longest known B&B time of every benchmark (by file name) over earlier result tables
+    exec_times = dict()
+    for path in sorted(glob.glob(os.path.join(out_folder, 'results_*'))):
+        try:
+            if path.endswith('.jsonl'):
+                result_df = pd.read_json(path, lines=True)
+            elif path.endswith('.csv'):
+                result_df = pd.read_csv(path)
+            elif path.endswith('.xlsx'):
+                result_df = pd.read_excel(path)
+            else:
+                continue
+        except (ImportError, ValueError) as error:
+            print(f'Skip {path}: {error}')
+            continue
+        if 'benchmark' not in result_df or 'bnb_exec_time' not in result_df:
+            continue
+        for _, row in result_df.iterrows():
+            if str(row['bnb_exec_time']).startswith('TIMEOUT'):
+                exec_time = float('inf')
+            else:
+                exec_time = row.get('bnb_exec_time_seconds', float('nan'))
+            if not pd.isna(exec_time):
+                exec_times[row['benchmark']] = max(exec_time, exec_times.get(row['benchmark'], 0.0))
+    return exec_times
+
+
+def run_tests_parallel(benchmarks: dict, n_workers: int = None, threads_per_worker: int = 1,
+                       time_limit: int = None, hard_time_limit: int = None, abs_tol: float = 1e-4,
+                       out_folder: str = 'results/', suffix: str = '', resume: bool = True, **kwargs):
+    # every benchmark runs in a worker process with its own CPLEX environment; results are
+    # appended to results_{suffix}.jsonl as they finish and tables are written once at the end
+    jsonl_path = out_folder + f'results_{suffix}.jsonl'
+    done = set()
+    if resume and os.path.exists(jsonl_path):
+        # failed jobs are run again
+        with open(jsonl_path) as file:
+            done = {result_dct['filepath'] for result_dct in map(json.loads, filter(str.strip, file))
+                    if not str(result_dct.get('bnb_exec_time')).startswith('ERROR')}
+    elif os.path.exists(jsonl_path):
+        os.remove(jsonl_path)
+    if time_limit and hard_time_limit is None:
+        hard_time_limit = int(1.1 * time_limit) + 60
+    # longest first, benchmarks without earlier results are assumed to be long
+    exec_times = previous_exec_times(out_folder)
+    todo = [filepath for filepath in benchmarks if filepath not in done]
+    todo.sort(key=lambda filepath: -exec_times.get(filepath.split('/')[-1], float('inf')))
+    print(f'{len(done)} benchmarks already done, {len(todo)} to run')
+    with ProcessPoolExecutor(max_workers=n_workers) as executor, open(jsonl_path, 'a') as out_file:
+        futures = {executor.submit(run_benchmark_job, filepath, benchmarks[filepath],
+                                   hard_time_limit=hard_time_limit, time_limit=time_limit,
+                                   abs_tol=abs_tol, threads=threads_per_worker, **kwargs): filepath
+                   for filepath in todo}
+        for future in as_completed(futures):
+            filepath = futures[future]
+            try:
+                result_dct = future.result()
+            except Exception as error:
+                print(filepath, error)
+                result_dct = dict(benchmark=filepath.split('/')[-1], filepath=filepath,
+                                  bnb_exec_time=f'ERROR: {error}', true_clique_size=benchmarks[filepath])
+            out_file.write(json.dumps(result_dct, default=lambda value: value.item()) + '\n')
+            out_file.flush()
+    # the last record of a benchmark wins
+    with open(jsonl_path) as file:
+        results = {result_dct['filepath']: result_dct for result_dct in map(json.loads, filter(str.strip, file))}
+    order = {filepath: index for index, filepath in enumerate(benchmarks)}
+    results = sorted(results.values(), key=lambda result_dct: order.get(result_dct['filepath'], len(order)))
+    result_df = pd.DataFrame(results)
+    result_df.to_csv(out_folder + f'results_{suffix}.csv')
+    result_df.to_excel(out_folder + f'results_{suffix}.xlsx')
+    return result_df
+
+
 if __name__ == '__main__':
     benchmarks = dict(**EASY,
                       **MEDIUM)
-    run_tests(benchmarks=benchmarks, time_limit=5400, suffix='', abs_tol=1e-4)
+    run_tests_parallel(benchmarks=benchmarks, time_limit=5400, suffix='', abs_tol=1e-4)
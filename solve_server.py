@@ -0,0 +1,412 @@
+import os
+import sys
+import json
+import time
+import queue
+import itertools
+import threading
+import socketserver
+import collections
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+import numpy as np
+
+import utils
+from backend import BACKENDS, make_backend
+from heuristic import HeuristicMaxClique
+from branch_and_bound import BranchAndBound
+from reduction import GraphReducer
+from dimacs import CSRGraph, load_dimacs
+
+# a worker still busy this long after the deadline of its request is restarted
+GRACE_PERIOD = 1.0
+# default local search budget of a request; small instances are solved in a few milliseconds
+HEURISTIC_TIME = 0.005
+# 5-cycle: the LP has to branch, so the warm-up runs every part of a solve
+WARM_UP_REQUEST = dict(edges=[[1, 2], [2, 3], [3, 4], [4, 5], [5, 1]], reduce=False, heuristic_time=0.01)
+
+
+def request_graph(request: dict) -> CSRGraph:
+    # DIMACS file by 'filepath', or 'edges' as [u, v] pairs of nodes 1..'num_nodes'
+    # ('num_nodes' defaults to the largest node)
+    if 'filepath' in request:
+        return load_dimacs(request['filepath'])
+    edges = np.asarray(request['edges'], dtype=np.int64).reshape(-1, 2) - 1
+    num_of_nodes = int(request.get('num_nodes') or (edges.max() + 1 if len(edges) else 0))
+    if len(edges) and (edges.min() < 0 or edges.max() >= num_of_nodes):
+        raise ValueError('Edge nodes must be in 1..num_nodes')
+    return CSRGraph.from_edges(num_of_nodes, edges)
+
+
+def solve(request: dict, deadline: float = None, environment=None, on_clique=None) -> dict:
+    # heuristic, reduction and B&B as in run_test; on_clique(size, clique) is called with every
+    # better clique found, cliques are lists of nodes of the request graph
+    tic = time.perf_counter()
+    graph = request_graph(request)
+    if graph.number_of_nodes() == 0:
+        return dict(size=0, clique=[], optimal=True, timed_out=False, upper_bound=0, gap=0.0, nodes=0,
+                    solve_time=time.perf_counter() - tic)
+    heuristic_time = request.get('heuristic_time', HEURISTIC_TIME)
+    if deadline is not None:
+        heuristic_time = max(min(heuristic_time, 0.2 * (deadline - time.time())), 0.0)
+    heuristic_clique = HeuristicMaxClique(graph, time_budget=heuristic_time, seed=request.get('seed')).run()
+    heuristic_clique_size = int(sum(heuristic_clique))
+    best = dict(size=heuristic_clique_size, clique=utils.to_node_indexes(heuristic_clique))
+    if on_clique is not None:
+        on_clique(best['size'], best['clique'])
+    reducer = GraphReducer(graph, lower_bound=heuristic_clique_size) if request.get('reduce', True) else None
+    bnb_graph = reducer.run() if reducer else graph
+    result = dict(best, optimal=True, timed_out=False, upper_bound=heuristic_clique_size, gap=0.0, nodes=0)
+    # no vertex left for a larger clique
+    if bnb_graph.number_of_nodes() == 0:
+        return dict(result, solve_time=time.perf_counter() - tic)
+    if deadline is not None and deadline <= time.time():
+        return dict(result, optimal=False, timed_out=True, upper_bound=None, gap=None,
+                    solve_time=time.perf_counter() - tic)
+    backend = request.get('backend', 'cplex')
+    problem = make_backend(backend, bnb_graph, threads=1, environment=environment if backend == 'cplex' else None,
+                           lazy_pairs=request.get('lazy_pairs', False))
+    problem.design_problem()
+
+    def on_progress(event: dict):
+        if event['incumbent'] > best['size'] and event['clique']:
+            best['size'] = event['incumbent']
+            best['clique'] = reducer.to_original_nodes(event['clique']) if reducer else event['clique']
+            if on_clique is not None:
+                on_clique(best['size'], best['clique'])
+
+    bnb = BranchAndBound(problem=problem, initial_obj_value=heuristic_clique_size,
+                         initial_solution=reducer.to_reduced(heuristic_clique) if reducer else heuristic_clique,
+                         time_limit=deadline - time.time() if deadline is not None else None,
+                         node_selection=request.get('node_selection'),
+                         branching_rule=request.get('branching_rule', 'closest_to_one'),
+                         progress_callback=on_progress, progress_interval=request.get('progress_interval', 0.1))
+    bnb.timed_run()
+    if bnb.best_obj_value > heuristic_clique_size:
+        clique = utils.to_node_indexes(bnb.best_solution)
+        best = dict(size=bnb.best_obj_value, clique=reducer.to_original_nodes(clique) if reducer else clique)
+    return dict(best, optimal=bnb.upper_bound <= bnb.best_obj_value, timed_out=bnb.timed_out, upper_bound=bnb.upper_bound,
+                gap=bnb.gap, nodes=bnb.call_counter, solve_time=time.perf_counter() - tic)
+
+
+def solver_worker(worker_id: int, conn, verbose: bool):
+    # solves the requests sent over conn until it gets None. Imports, the CPLEX environment and
+    # a warm-up solve are paid once per worker; the solver output goes to stderr if verbose
+    sys.stdout = sys.stderr if verbose else open(os.devnull, 'w')
+    environment = None
+    try:
+        import cplex
+        environment = cplex.Cplex()
+    except ImportError:
+        pass
+    for backend in BACKENDS:
+        if backend != 'cplex' or environment is not None:
+            try:
+                solve(dict(WARM_UP_REQUEST, backend=backend), environment=environment)
+            except Exception as error:
+                print(f'Worker {worker_id}: {backend} warm-up failed: {error}', file=sys.stderr)
+    conn.send(dict(event='ready', worker=worker_id))
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        ticket, request, deadline = task
+
+        def on_clique(size: int, clique: list):
+            conn.send(dict(ticket=ticket, event='clique', size=size, clique=clique))
+
+        try:
+            result = solve(request, deadline=deadline, environment=environment, on_clique=on_clique)
+            conn.send(dict(ticket=ticket, event='result', **result))
+        except Exception as error:
+            conn.send(dict(ticket=ticket, event='error', message=f'{type(error).__name__}: {error}'))
+    conn.close()
+
+
+class JsonLinesWriter:
+    # one JSON object per line, written by a thread of its own: write only queues the message,
+    # so the server can reply while holding its lock and a slow client holds up nobody else
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.messages = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, message: dict):
+        self.messages.put(message)
+
+    def run(self):
+        while True:
+            message = self.messages.get()
+            if message is None:
+                return
+            line = json.dumps(message, default=lambda value: value.item()) + '\n'
+            try:
+                self.stream.write(line)
+                self.stream.flush()
+            except (OSError, ValueError):
+                # the client went away
+                pass
+
+    def close(self):
+        # returns once the queued messages are written
+        self.messages.put(None)
+        self.thread.join()
+
+
+class SolveServer:
+    # pool of warm solver processes; requests are queued and handed to idle workers, events of a
+    # request ('clique' on every improvement, then 'result' or 'error') go to its reply callable
+
+    def __init__(self, n_workers: int = None, time_limit: float = None, verbose: bool = False,
+                 grace_period: float = GRACE_PERIOD):
+        self.n_workers = n_workers or os.cpu_count()
+        # default deadline of requests without 'time_limit', seconds after they are received
+        self.time_limit = time_limit
+        self.verbose = verbose
+        self.grace_period = grace_period
+        self.context = mp.get_context('spawn')
+        self.workers = dict()
+        self.requests = dict()
+        self.backlog = collections.deque()
+        self.tickets = itertools.count()
+        self.lock = threading.RLock()
+        self.done = threading.Condition(self.lock)
+        self.closed = False
+        self.served = 0
+        self.restarts = 0
+        self.service_times = collections.deque(maxlen=1000)
+        for worker_id in range(self.n_workers):
+            self.start_worker(worker_id)
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def start_worker(self, worker_id: int):
+        conn, worker_conn = self.context.Pipe()
+        process = self.context.Process(target=solver_worker, args=(worker_id, worker_conn, self.verbose),
+                                       daemon=True)
+        process.start()
+        worker_conn.close()
+        self.workers[worker_id] = dict(process=process, conn=conn, ready=False, ticket=None)
+
+    def wait_ready(self, timeout: float = 60.0):
+        # blocks until every worker finished its warm-up
+        deadline = time.time() + timeout
+        with self.lock:
+            while not all(worker['ready'] for worker in self.workers.values()) and time.time() < deadline:
+                self.done.wait(0.05)
+
+    def submit(self, request: dict, reply) -> int:
+        # reply(message) gets the events of the request tagged with its 'id'; it is called with
+        # the lock held and must not block, see JsonLinesWriter
+        if 'filepath' not in request and 'edges' not in request:
+            reply(dict(id=request.get('id'), event='error', message='Request needs filepath or edges'))
+            return None
+        if request.get('backend', 'cplex') not in BACKENDS:
+            reply(dict(id=request.get('id'), event='error', message=f'Unknown backend {request["backend"]}'))
+            return None
+        received = time.time()
+        time_limit = request.get('time_limit', self.time_limit)
+        with self.lock:
+            ticket = next(self.tickets)
+            self.requests[ticket] = dict(id=request.get('id'), reply=reply, received=received,
+                                         deadline=received + time_limit if time_limit is not None else None,
+                                         best=dict(size=0, clique=[]))
+            self.backlog.append((ticket, request))
+            self.assign()
+        return ticket
+
+    def assign(self):
+        # hand queued requests to idle workers; requests already past their deadline are answered
+        # right away
+        idle = [worker_id for worker_id, worker in self.workers.items() if worker['ready'] and worker['ticket'] is None]
+        while idle and self.backlog:
+            ticket, request = self.backlog.popleft()
+            deadline = self.requests[ticket]['deadline']
+            if deadline is not None and deadline <= time.time():
+                self.finish(ticket, dict(event='result', size=0, clique=[], optimal=False, timed_out=True,
+                                         upper_bound=None, gap=None, nodes=0, solve_time=0.0))
+                continue
+            worker_id = idle.pop()
+            self.workers[worker_id]['ticket'] = ticket
+            self.workers[worker_id]['conn'].send((ticket, request, deadline))
+
+    def dispatch(self):
+        while True:
+            with self.lock:
+                if self.closed and not self.requests:
+                    return
+                conns = {worker['conn']: worker_id for worker_id, worker in self.workers.items()}
+            for conn in wait(list(conns), timeout=0.05):
+                try:
+                    event = conn.recv()
+                except (EOFError, OSError):
+                    self.restart(conns[conn], 'Worker died')
+                    continue
+                self.handle(conns[conn], event)
+            self.enforce_deadlines()
+
+    def handle(self, worker_id: int, event: dict):
+        with self.lock:
+            worker = self.workers.get(worker_id)
+            if worker is None:
+                return
+            if event['event'] == 'ready':
+                worker['ready'] = True
+                self.done.notify_all()
+            elif event['event'] == 'clique':
+                request = self.requests.get(event['ticket'])
+                if request is not None and event['size'] > request['best']['size']:
+                    request['best'] = dict(size=event['size'], clique=event['clique'])
+                    request['reply'](dict(id=request['id'], event='clique', size=event['size'],
+                                          clique=event['clique'], elapsed=time.time() - request['received']))
+            else:
+                worker['ticket'] = None
+                self.finish(event.pop('ticket'), event)
+            self.assign()
+
+    def finish(self, ticket: int, event: dict):
+        request = self.requests.pop(ticket)
+        elapsed = time.time() - request['received']
+        request['reply'](dict(id=request['id'], **event, elapsed=elapsed))
+        self.served += 1
+        self.service_times.append(elapsed)
+        self.done.notify_all()
+
+    def enforce_deadlines(self):
+        # a worker stuck past the deadline (e.g. building a large model) is replaced, the request
+        # gets the best clique reported so far
+        now = time.time()
+        with self.lock:
+            for worker_id, worker in list(self.workers.items()):
+                ticket = worker['ticket']
+                if ticket is None:
+                    continue
+                deadline = self.requests[ticket]['deadline']
+                if deadline is not None and now > deadline + self.grace_period:
+                    self.restart(worker_id, None)
+
+    def restart(self, worker_id: int, message: str):
+        with self.lock:
+            worker = self.workers.pop(worker_id)
+            worker['process'].terminate()
+            worker['conn'].close()
+            self.restarts += 1
+            ticket = worker['ticket']
+            if ticket is not None:
+                best = self.requests[ticket]['best']
+                if message is None:
+                    self.finish(ticket, dict(event='result', **best, optimal=False, timed_out=True,
+                                             upper_bound=None, gap=None, nodes=None, solve_time=None))
+                else:
+                    self.finish(ticket, dict(event='error', message=message))
+            if not self.closed:
+                self.start_worker(worker_id)
+
+    def wait(self, tickets: list):
+        # blocks until the given requests are answered
+        with self.lock:
+            while any(ticket in self.requests for ticket in tickets):
+                self.done.wait(0.1)
+
+    def stats(self) -> dict:
+        with self.lock:
+            service_times = np.asarray(self.service_times, dtype=float)
+            return dict(event='stats', workers=len(self.workers),
+                        busy=sum(worker['ticket'] is not None for worker in self.workers.values()),
+                        queued=len(self.backlog), served=self.served, restarts=self.restarts,
+                        p50_seconds=float(np.percentile(service_times, 50)) if len(service_times) else None,
+                        p90_seconds=float(np.percentile(service_times, 90)) if len(service_times) else None)
+
+    def close(self):
+        # answers the pending requests, then stops the workers
+        with self.lock:
+            self.closed = True
+            while self.requests:
+                self.done.wait(0.1)
+        self.dispatcher.join()
+        for worker in self.workers.values():
+            try:
+                worker['conn'].send(None)
+            except OSError:
+                pass
+        for worker in self.workers.values():
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+
+
+def serve_lines(server: SolveServer, lines, writer: JsonLinesWriter) -> list:
+    # requests of one client, one JSON object per line; {"command": "stats"} reports the pool
+    # state and {"command": "shutdown"} stops reading. Returns the tickets of the requests
+    tickets = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as error:
+            writer.write(dict(event='error', message=f'Invalid JSON: {error}'))
+            continue
+        command = request.get('command')
+        if command == 'shutdown':
+            break
+        elif command == 'stats':
+            writer.write(server.stats())
+        else:
+            ticket = server.submit(request, writer.write)
+            if ticket is not None:
+                tickets.append(ticket)
+    return tickets
+
+
+class TextWriter:
+    # text interface of a socket file for JsonLinesWriter
+    def __init__(self, binary_file):
+        self.binary_file = binary_file
+
+    def write(self, text: str):
+        self.binary_file.write(text.encode())
+
+    def flush(self):
+        self.binary_file.flush()
+
+
+def serve_tcp(server: SolveServer, port: int, host: str = '127.0.0.1'):
+    class Handler(socketserver.StreamRequestHandler):
+        # events are small writes, don't hold them back waiting for acks
+        disable_nagle_algorithm = True
+
+        def handle(self):
+            # the connection stays open until its requests are answered
+            lines = (line.decode() for line in self.rfile)
+            writer = JsonLinesWriter(TextWriter(self.wfile))
+            server.wait(serve_lines(server, lines, writer))
+            writer.close()
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((host, port), Handler) as tcp_server:
+        print(f'Serving on {host}:{port}', file=sys.stderr)
+        tcp_server.daemon_threads = True
+        try:
+            tcp_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    args = utils.server_arg_parser()
+    server = SolveServer(n_workers=args.workers, time_limit=args.time_limit, verbose=args.verbose)
+    server.wait_ready()
+    print(f'{server.n_workers} workers ready', file=sys.stderr)
+    if args.port:
+        serve_tcp(server, args.port)
+        server.close()
+    else:
+        writer = JsonLinesWriter(sys.stdout)
+        serve_lines(server, sys.stdin, writer)
+        server.close()
+        writer.close()
@@ -0,0 +1,187 @@
+import time
+import hashlib
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+import utils
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Symmetry:
+    # vertex symmetries of the graph the search runs on: twin classes (vertices with equal open
+    # or closed neighborhoods, any two of them can be swapped) and orbits of the automorphisms
+    # found by an individualization-refinement search within time_limit seconds. An unfinished
+    # search only leaves orbits split, every vertex pair of an orbit is symmetric
+
+    def __init__(self, graph: nx.Graph, time_limit: float = 10.0, seed: int = 0):
+        # graph is nx.Graph or dimacs.CSRGraph
+        tic = time.perf_counter()
+        self.adjacency = utils.adjacency_matrix(graph).astype(np.int64).tocsr()
+        self.adjacency.sort_indices()
+        self.num_of_nodes = self.adjacency.shape[0]
+        self.rng = np.random.default_rng(seed)
+        self.twins = self.twin_classes()
+        self.generators = []
+        self.complete = True
+        self.orbits = self.vertex_orbits(time_limit)
+        self.detection_time = time.perf_counter() - tic
+        # the matrices are only needed for the detection, keep the object small to pickle
+        self.adjacency = None
+        self.rng = None
+        print(f'SYMMETRY: {self.num_orbits()} orbits, {len(self.twins)} twin classes')
+
+    def num_orbits(self) -> int:
+        # orbits of two or more vertices
+        return int((np.bincount(self.orbits) > 1).sum())
+
+    def orbit_classes(self) -> list:
+        order = np.argsort(self.orbits, kind='stable')
+        bounds = np.flatnonzero(np.diff(self.orbits[order])) + 1
+        return [cell.tolist() for cell in np.split(order, bounds) if len(cell) > 1]
+
+    def twin_classes(self) -> list:
+        # rows are grouped by two random linear hashes and compared exactly within a group
+        classes = []
+        identity = sp.identity(self.num_of_nodes, dtype=np.int64, format='csr')
+        for matrix in (self.adjacency, (self.adjacency + identity).tocsr()):
+            keys = matrix @ self.rng.integers(0, 1 << 40, size=(self.num_of_nodes, 2))
+            degrees = np.diff(matrix.indptr)
+            order = np.lexsort((keys[:, 1], keys[:, 0], degrees))
+            step = (np.diff(degrees[order]) != 0) | np.any(np.diff(keys[order], axis=0) != 0, axis=1)
+            for group in np.split(order, np.flatnonzero(step) + 1):
+                if len(group) < 2:
+                    continue
+                rows = dict()
+                for var_index in group.tolist():
+                    row = matrix.indices[matrix.indptr[var_index]:matrix.indptr[var_index + 1]]
+                    rows.setdefault(row.tobytes(), []).append(var_index)
+                classes.extend(sorted(twins) for twins in rows.values() if len(twins) > 1)
+        return classes
+
+    def refine(self, adjacency: sp.csr_matrix, colors: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        # equitable partition: split color classes by the colors of the neighbors until stable.
+        # New colors are ordered by (old color, neighborhood hash), so refining the disjoint union
+        # of two graphs labels corresponding classes of both alike
+        num_colors = colors.max() + 1
+        while True:
+            signature = adjacency @ weights[colors]
+            order = np.lexsort((signature, colors))
+            step = (np.diff(colors[order]) != 0) | (np.diff(signature[order]) != 0)
+            refined = np.empty_like(colors)
+            refined[order] = np.concatenate([[0], np.cumsum(step)])
+            if refined.max() + 1 == num_colors:
+                return refined
+            colors, num_colors = refined, refined.max() + 1
+
+    def vertex_orbits(self, time_limit: float) -> np.ndarray:
+        # orbit label per var index. Refining the graph with one vertex individualized gives a
+        # certificate: vertices of one orbit have equal ones, and equal discrete partitions map
+        # the vertices on each other. Other vertices of a certificate class are tried as images
+        # of the class representatives; every automorphism found merges orbits
+        n = self.num_of_nodes
+        labels = self.merge_orbits()
+        if n == 0:
+            return labels
+        weights = self.rng.integers(1, 1 << 40, size=2 * n + 1)
+        cells = self.refine(self.adjacency, np.zeros(n, dtype=np.int64), weights)
+        union = sp.block_diag([self.adjacency, self.adjacency], format='csr')
+        rows = np.repeat(np.arange(n), np.diff(self.adjacency.indptr))
+        deadline = time.perf_counter() + time_limit
+        representatives = dict()
+        # a vertex alone in its refinement cell is alone in its orbit
+        cell_sizes = np.bincount(cells)
+        try:
+            for var_index in np.flatnonzero(cell_sizes[cells] > 1).tolist():
+                if time.perf_counter() > deadline:
+                    raise SearchTimeout()
+                colors = self.refine(self.adjacency, self.individualize(cells, var_index), weights)
+                is_discrete = colors.max() + 1 == n
+                if is_discrete:
+                    edges = np.sort(colors[rows] * n + colors[self.adjacency.indices])
+                    certificate = hashlib.sha1(edges.tobytes()).digest()
+                else:
+                    certificate = np.bincount(colors).tobytes()
+                key = (int(cells[var_index]), is_discrete, certificate)
+                for representative in representatives.setdefault(key, []):
+                    if labels[representative] == labels[var_index]:
+                        break
+                    if is_discrete:
+                        source_colors = self.refine(self.adjacency, self.individualize(cells, representative),
+                                                    weights)
+                        automorphism = np.argsort(colors)[source_colors]
+                        if not self.is_automorphism(automorphism):
+                            automorphism = None
+                    else:
+                        automorphism = self.find_automorphism(union, cells, weights, representative,
+                                                              var_index, deadline)
+                    if automorphism is not None:
+                        self.generators.append(automorphism)
+                        labels = self.merge_orbits()
+                        break
+                else:
+                    representatives[key].append(var_index)
+        except SearchTimeout:
+            self.complete = False
+            print(f'Symmetry detection stopped after {time_limit}s')
+        return labels
+
+    def merge_orbits(self) -> np.ndarray:
+        # connected components of the vertex -> image pairs of the generators and twin swaps
+        n = self.num_of_nodes
+        twin_pairs = np.array([(twins[0], twin) for twins in self.twins for twin in twins[1:]],
+                              dtype=np.int64).reshape(-1, 2)
+        rows = np.concatenate([np.arange(n)] * len(self.generators) + [twin_pairs[:, 0]])
+        cols = np.concatenate(self.generators + [twin_pairs[:, 1]])
+        graph = sp.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+        return connected_components(graph, directed=False)[1]
+
+    def find_automorphism(self, union: sp.csr_matrix, cells: np.ndarray, weights: np.ndarray,
+                          source: int, target: int, deadline: float) -> np.ndarray:
+        # automorphism mapping source to target: individualize both in the two copies of the
+        # disjoint union and refine, then branch on the smallest non-singleton cell
+        colors = np.concatenate([cells, cells])
+        return self.search(union, self.individualize(colors, source, self.num_of_nodes + target),
+                           weights, deadline)
+
+    @staticmethod
+    def individualize(colors: np.ndarray, *vertices) -> np.ndarray:
+        # the vertices get a new color of their own
+        colors = colors.copy()
+        colors[list(vertices)] = colors.max() + 1
+        return colors
+
+    def search(self, union: sp.csr_matrix, colors: np.ndarray, weights: np.ndarray,
+               deadline: float) -> np.ndarray:
+        if time.perf_counter() > deadline:
+            raise SearchTimeout()
+        n = self.num_of_nodes
+        colors = self.refine(union, colors, weights)
+        left, right = colors[:n], colors[n:]
+        num_colors = colors.max() + 1
+        left_sizes = np.bincount(left, minlength=num_colors)
+        if not np.array_equal(left_sizes, np.bincount(right, minlength=num_colors)):
+            return None
+        if left_sizes.max() == 1:
+            vertex_of_color = np.empty(num_colors, dtype=np.int64)
+            vertex_of_color[right] = np.arange(n)
+            permutation = vertex_of_color[left]
+            return permutation if self.is_automorphism(permutation) else None
+        sizes = np.where(left_sizes > 1, left_sizes, n + 1)
+        color = int(np.argmin(sizes))
+        source = int(np.flatnonzero(left == color)[0])
+        for target in np.flatnonzero(right == color).tolist():
+            automorphism = self.search(union, self.individualize(colors, source, n + target), weights, deadline)
+            if automorphism is not None:
+                return automorphism
+        return None
+
+    def is_automorphism(self, permutation: np.ndarray) -> bool:
+        # a bijection mapping every edge on an edge
+        rows = np.repeat(np.arange(self.num_of_nodes), np.diff(self.adjacency.indptr))
+        mapped = self.adjacency[permutation[rows], permutation[self.adjacency.indices]]
+        return bool(np.all(np.asarray(mapped)))
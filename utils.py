@@ -1,20 +1,32 @@
+import json
 import time
-import math
+import itertools
 import argparse
 import functools
+import numpy as np
 import networkx as nx
+import scipy.sparse as sp
 
 
 def to_node_indexes(solution: list, abs_tol: float = 1e-5) -> list:
     # transform [1, 0,  1,... 1] to [1, 3, ... 10]
-    return [var_index + 1 for var_index, var in enumerate(solution)
-            if math.isclose(var, 1, abs_tol=abs_tol)]
+    solution = np.asarray(solution, dtype=float)
+    return (np.flatnonzero(np.abs(solution - 1) <= abs_tol) + 1).tolist()
+
+
+def adjacency_matrix(graph) -> sp.csr_matrix:
+    # boolean adjacency of nx.Graph or dimacs.CSRGraph, row/column i stands for node i + 1
+    if isinstance(graph, nx.Graph):
+        return sp.csr_matrix(nx.adjacency_matrix(graph, nodelist=sorted(graph.nodes())), dtype=np.bool_)
+    return graph.adjacency()
 
 
 def is_clique(graph: nx.Graph, nodes: list) -> bool:
-    subgraph: nx.Graph = graph.subgraph(nodes)
-    num_of_nodes = subgraph.number_of_nodes()
-    num_of_edges = subgraph.number_of_edges()
+    if isinstance(graph, nx.Graph):
+        return all(graph.has_edge(node_i, node_j) for node_i, node_j in itertools.combinations(nodes, 2))
+    var_indexes = np.asarray(nodes, dtype=np.int64) - 1
+    num_of_nodes = len(var_indexes)
+    num_of_edges = graph.adjacency()[var_indexes][:, var_indexes].nnz // 2
     num_of_edges_complete = int(num_of_nodes * (num_of_nodes - 1) / 2)
     if num_of_edges == num_of_edges_complete:
         return True
@@ -44,9 +56,19 @@ def read_graph_file(file_path: str, verbose: bool = True) -> nx.Graph:
 
 
 class TimeoutException(Exception):
-    def __init__(self, best_clique_size: int, msg: str = 'TIME OUT!'):
+    def __init__(self, best_clique_size: int, msg: str = 'TIME OUT!', best_solution: list = None):
         self.msg = msg
         self.best_clique_size = best_clique_size
+        self.best_solution = best_solution
+
+
+def progress_printer(stream):
+    # progress callback writing every event as a JSON line
+    def on_progress(event: dict):
+        stream.write(json.dumps(event) + '\n')
+        stream.flush()
+
+    return on_progress
 
 
 def timer(func):
@@ -69,4 +91,107 @@ def main_arg_parser():
                         default=1e-5, help='absolute tolerance value for comparative operations')
     parser.add_argument('--verbose', type=bool, default=False,
                         help='Whether to stream solver logs')
+    parser.add_argument('--node_selection', type=str, default=None,
+                        choices=['dfs', 'best_bound', 'best_estimate', 'hybrid'],
+                        help='Explore B&B nodes from an explicit queue in this order (recursive DFS if not set)')
+    parser.add_argument('--max_open_nodes', type=int, default=None,
+                        help='Select nodes depth-first while the node queue is larger than this')
+    parser.add_argument('--separate_cuts', action='store_true',
+                        help='Add violated independent set cuts after every LP solve')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Split the B&B tree between this many worker processes')
+    parser.add_argument('--time_limit', type=int, default=None,
+                        help='Stop after this many seconds with the best clique found and its optimality gap')
+    parser.add_argument('--progress_file', type=str, default=None,
+                        help='Stream progress events as JSON lines to this file (- for stdout)')
+    parser.add_argument('--progress_interval', type=float, default=1.0,
+                        help='Seconds between progress events')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Write the B&B frontier to this file periodically and on timeout')
+    parser.add_argument('--checkpoint_interval', type=float, default=10.0,
+                        help='Seconds between checkpoints')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue from the checkpoint (<filepath>.ckpt if --checkpoint is not set)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the solver phases and report them as prof_* fields')
+    parser.add_argument('--profile_output', type=str, default=None,
+                        help='Profile the B&B run into this file: cProfile stats for *.prof, '
+                             'collapsed stacks (flamegraph input) otherwise')
+    parser.add_argument('--branching_rule', type=str, default='closest_to_one',
+                        choices=['closest_to_one', 'most_fractional', 'pseudo_cost', 'degree_weighted'],
+                        help='How the branching var is chosen among the free vars')
+    parser.add_argument('--backend', type=str, default='cplex', choices=['cplex', 'native'],
+                        help='Solve B&B nodes by CPLEX LP relaxations or by the native bitset search')
+    parser.add_argument('--symmetry', action='store_true',
+                        help='Detect vertex orbits and twins, fix symmetric vars in zero branches')
+    parser.add_argument('--symmetry_time_limit', type=float, default=10.0,
+                        help='Time for the automorphism search in seconds')
+    parser.add_argument('--lazy_pairs', action='store_true',
+                        help='Add x_i + x_j <= 1 rows of non-edges only when an LP solution violates them')
+    return parser.parse_args()
+
+
+def bench_arg_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the solver and compare against a baseline')
+    parser.add_argument('--tier', type=str, default='synthetic-small',
+                        choices=['easy', 'medium', 'hard', 'synthetic-small', 'synthetic-medium'],
+                        help='Benchmark set; DIMACS tiers fall back to synthetic graphs if their files are missing')
+    parser.add_argument('--trials', type=int, default=5,
+                        help='Runs per instance (at least 4), trial t uses seed + t')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--time_limit', type=int, default=None,
+                        help='B&B time limit of every run in seconds')
+    parser.add_argument('--backend', type=str, default='cplex', choices=['cplex', 'native'])
+    parser.add_argument('--node_selection', type=str, default=None,
+                        choices=['dfs', 'best_bound', 'best_estimate', 'hybrid'])
+    parser.add_argument('--branching_rule', type=str, default='closest_to_one',
+                        choices=['closest_to_one', 'most_fractional', 'pseudo_cost', 'degree_weighted'])
+    parser.add_argument('--output', type=str, default=None,
+                        help='Report file (results/bench_<tier>_<time>.json by default)')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='Earlier report to compare with, exits with 1 on regressions')
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help='Significance level of the Mann-Whitney U test')
+    parser.add_argument('--min_change', type=float, default=0.05,
+                        help='Relative change of the median below which differences are ignored')
+    parser.add_argument('--lazy_pairs', action='store_true',
+                        help='Separate the pair rows on demand instead of building all of them')
+    args = parser.parse_args()
+    # the smallest one-sided Mann-Whitney p-value of n runs per side is 1 / C(2n, n):
+    # 0.05 for 3 runs, so fewer than 4 could never flag a regression
+    if args.trials < 4:
+        parser.error('--trials must be at least 4 for the regression test')
+    return args
+
+
+def server_arg_parser():
+    parser = argparse.ArgumentParser(description='Serve max clique requests (JSON lines) from a pool of warm solvers')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of solver processes (CPU count by default)')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Listen on 127.0.0.1:port instead of reading stdin')
+    parser.add_argument('--time_limit', type=float, default=None,
+                        help='Deadline of requests without time_limit, in seconds after arrival')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Solver output of the workers goes to stderr')
+    return parser.parse_args()
+
+
+def large_graph_arg_parser():
+    parser = argparse.ArgumentParser(description='Maximum clique of a large sparse graph by degeneracy subproblems')
+    parser.add_argument('--filepath', type=str, required=True,
+                        help='Path to DIMACS-format file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes solving subproblems (CPU count by default)')
+    parser.add_argument('--backend', type=str, default='cplex', choices=['cplex', 'native'])
+    parser.add_argument('--time_limit', type=float, default=None,
+                        help='Stop after this many seconds with the best clique found and an upper bound')
+    parser.add_argument('--heuristic_only', action='store_true',
+                        help='Solve subproblems by local search only (a lower bound)')
+    parser.add_argument('--batch_size', type=int, default=64,
+                        help='Subproblems per task sent to a worker')
+    parser.add_argument('--chunk_mb', type=int, default=64,
+                        help='Megabytes of the edge list read at a time while writing the ordered CSR')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show the solver output of the subproblems')
     return parser.parse_args()